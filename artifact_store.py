@@ -0,0 +1,304 @@
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import llm_registry
+import telemetry
+from manifest import hash_text
+
+DEFAULT_STORE_PATH = "data/artifacts.sqlite"
+
+# 各表的列（不含自增 id）；写入时缺失的列为 NULL
+SCHEMA = {
+    "runs": ("run_id", "started_at", "argv"),
+    "requests": ("run_id", "ts", "model", "stage", "chapter", "section", "prompt_tokens", "completion_tokens",
+                 "reasoning_tokens", "cached_tokens", "latency", "ttft", "cached", "error", "retries"),
+    "candidates": ("run_id", "ts", "chapter", "section", "model", "sha256", "content"),
+    "comparisons": ("comparison_id", "run_id", "ts", "chapter", "section", "judge_model", "strategy",
+                    "n_candidates", "winner", "winner_sha256", "info"),
+    "votes": ("comparison_id", "run_id", "ts", "judge_model", "vote_index", "selected", "path"),
+    "critic_rounds": ("run_id", "ts", "chapter", "section", "run_dir", "round", "kind", "severity", "score",
+                      "change", "error", "text"),
+    # 按原文件布局保存的备份文件内容，export 时按 path 还原
+    "files": ("path", "run_id", "ts", "content"),
+}
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, started_at REAL, argv TEXT);
+CREATE TABLE IF NOT EXISTS requests (id INTEGER PRIMARY KEY, run_id TEXT, ts REAL, model TEXT, stage TEXT,
+    chapter TEXT, section TEXT, prompt_tokens INTEGER, completion_tokens INTEGER, reasoning_tokens INTEGER,
+    cached_tokens INTEGER, latency REAL, ttft REAL, cached INTEGER, error TEXT, retries INTEGER);
+CREATE INDEX IF NOT EXISTS requests_run ON requests (run_id);
+CREATE INDEX IF NOT EXISTS requests_model_stage ON requests (model, stage);
+CREATE INDEX IF NOT EXISTS requests_section ON requests (chapter, section);
+CREATE TABLE IF NOT EXISTS candidates (id INTEGER PRIMARY KEY, run_id TEXT, ts REAL, chapter TEXT, section TEXT,
+    model TEXT, sha256 TEXT, content TEXT);
+CREATE INDEX IF NOT EXISTS candidates_sha256 ON candidates (sha256);
+CREATE INDEX IF NOT EXISTS candidates_section ON candidates (chapter, section, model);
+CREATE TABLE IF NOT EXISTS comparisons (comparison_id TEXT PRIMARY KEY, run_id TEXT, ts REAL, chapter TEXT,
+    section TEXT, judge_model TEXT, strategy TEXT, n_candidates INTEGER, winner INTEGER, winner_sha256 TEXT,
+    info TEXT);
+CREATE INDEX IF NOT EXISTS comparisons_section ON comparisons (chapter, section, ts);
+CREATE INDEX IF NOT EXISTS comparisons_winner ON comparisons (winner_sha256);
+CREATE TABLE IF NOT EXISTS votes (id INTEGER PRIMARY KEY, comparison_id TEXT, run_id TEXT, ts REAL,
+    judge_model TEXT, vote_index INTEGER, selected INTEGER, path TEXT);
+CREATE INDEX IF NOT EXISTS votes_comparison ON votes (comparison_id);
+CREATE TABLE IF NOT EXISTS critic_rounds (id INTEGER PRIMARY KEY, run_id TEXT, ts REAL, chapter TEXT,
+    section TEXT, run_dir TEXT, round INTEGER, kind TEXT, severity REAL, score REAL, change REAL, error TEXT,
+    text TEXT);
+CREATE INDEX IF NOT EXISTS critic_rounds_section ON critic_rounds (chapter, section, ts);
+CREATE INDEX IF NOT EXISTS critic_rounds_run_dir ON critic_rounds (run_dir);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, run_id TEXT, ts REAL, content TEXT);
+CREATE INDEX IF NOT EXISTS files_run ON files (run_id);
+"""
+
+# 主键冲突时覆盖旧记录的表（同一路径的文件、同一次比较重复写入）
+_REPLACE = {"runs", "comparisons", "files"}
+
+
+class ArtifactStore:
+    """
+    以 SQLite（WAL 模式）保存每次运行的请求记录、候选、评审投票与批评-修订轮次，便于按模型、章节、时间查询。
+
+    写入只是放入队列，由后台线程按 batch_size 条或 flush_interval 秒合并为一个事务提交，调用方不会等待磁盘；
+    读取（query、export）使用独立连接，WAL 模式下不会阻塞写入。进程退出时自动提交剩余记录。
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, batch_size=200, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.run_registered = False
+        self.error = None
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                conn = self._connect()
+                conn.executescript(_DDL)
+                conn.close()
+                self.thread = threading.Thread(target=self._writer, name="artifact-store", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+            if not self.run_registered:
+                self.run_registered = True
+                self.queue.put(("runs", {"run_id": telemetry.RUN_ID, "started_at": time.time(),
+                                         "argv": " ".join(sys.argv)}))
+
+    def _writer(self):
+        conn = self._connect()
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            # 凑满一批或等到 flush_interval 后一起提交；收到 None（flush/close 请求）时立即提交
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+            try:
+                self._commit(conn, [i for i in batch if i is not None])
+            except sqlite3.Error as e:
+                self.error = e
+                print(f"写入 {self.path} 失败: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    @staticmethod
+    def _commit(conn, batch):
+        by_table = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(tuple(row.get(c) for c in SCHEMA[table]))
+        with conn:
+            for table, rows in by_table.items():
+                columns = SCHEMA[table]
+                verb = "INSERT OR REPLACE" if table in _REPLACE else "INSERT"
+                conn.executemany(f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                 rows)
+
+    def add(self, table, **fields):
+        """放入一条记录；未给出的 run_id、ts、chapter、section 取当前运行与 telemetry 标签。"""
+        if table not in SCHEMA:
+            raise ValueError(f"未知的表: {table}")
+        self._start()
+        row = {"run_id": telemetry.RUN_ID, "ts": time.time()}
+        tags = telemetry.current_tags()
+        row.update({k: tags.get(k) for k in ("chapter", "section") if k in SCHEMA[table]})
+        row.update(fields)
+        self.queue.put((table, row))
+
+    def flush(self):
+        """等待队列中的记录全部提交。"""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+
+    def query(self, sql, params=()):
+        """提交未写入的记录后执行只读查询，返回 dict 列表。"""
+        self.flush()
+        if not os.path.exists(self.path):
+            return []
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            return [dict(r) for r in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def export(self, target_dir=".", run_id=None):
+        """
+        按原文件布局导出备份文件（评审投票、批评-修订每轮的原始输出等），路径相对于 target_dir。
+
+        返回：
+            int: 导出的文件数。
+        """
+        sql, params = "SELECT path, content FROM files", ()
+        if run_id:
+            sql, params = sql + " WHERE run_id = ?", (run_id,)
+        count = 0
+        for row in self.query(sql, params):
+            path = row["path"] if not os.path.isabs(row["path"]) else os.path.relpath(row["path"], "/")
+            full = os.path.join(target_dir, path)
+            os.makedirs(os.path.dirname(full) or ".", exist_ok=True)
+            with open(full, "w", encoding="utf-8") as f:
+                f.write(row["content"] or "")
+            count += 1
+        return count
+
+
+_store = None
+_configured = False
+_settings = {"enabled": True, "path": DEFAULT_STORE_PATH, "backup_files": True}
+_lock = threading.Lock()
+
+
+def _record_request(entry):
+    add("requests", **{k: entry.get(k) for k in SCHEMA["requests"]})
+
+
+telemetry.add_listener(_record_request)
+
+
+def configure(store_settings):
+    """
+    根据 config.json 中的 "artifact_store" 配置数据库：
+        {"enabled": true, "path": "data/artifacts.sqlite", "backup_files": true, "batch_size": 200, "flush_interval": 0.5}
+    backup_files 为 false 时 data/backups 下的评审与批评-修订中间文件只写入数据库，需要时用 export 还原。
+    """
+    global _store, _settings, _configured
+    settings = {"enabled": True, "path": DEFAULT_STORE_PATH, "backup_files": True}
+    settings.update(store_settings or {})
+    with _lock:
+        if _store is not None:
+            _store.close()
+        _settings = settings
+        _store = ArtifactStore(settings["path"], settings.get("batch_size", 200), settings.get("flush_interval", 0.5)) \
+            if settings["enabled"] else None
+        _configured = True
+
+
+def get_store():
+    """返回全局的 ArtifactStore，未启用时返回 None；尚未配置时按 config.json 配置。"""
+    if not _configured:
+        configure(llm_registry.get_settings().get("artifact_store", {}))
+    return _store
+
+
+def add(table, **fields):
+    store = get_store()
+    if store is not None:
+        store.add(table, **fields)
+
+
+def save_backup(path, content, keep_file=False):
+    """
+    保存一个备份文件：写入数据库的 files 表，backup_files 为 true 或 keep_file 为 true 时同时写入文件。
+
+    参数：
+        path (str): 原文件布局中的路径。
+        content (str or dict): 文件内容，dict 按 JSON 保存。
+        keep_file (bool): 始终写入文件，用于运行目录中需要直接查看的记录（如 stop.json）。
+    """
+    if not path:
+        return
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, indent=2)
+    store = get_store()
+    if keep_file or _settings.get("backup_files", True) or store is None:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+        except OSError:
+            pass
+    add("files", path=path.replace(os.sep, "/"), content=content)
+
+
+def record_candidate(model, content):
+    add("candidates", model=model, sha256=hash_text(content), content=content)
+
+
+def win_counts(chapter=None, section_like=None, since=None, path=None):
+    """
+    各模型的候选在评审中胜出的次数（胜出的候选按内容哈希与候选表关联）。
+
+    参数：
+        chapter (str): 只统计该章节。
+        section_like (str): 小节的 LIKE 模式，如 "方法/%"。
+        since (float): 只统计该时间戳之后的评审。
+    """
+    store = get_store() if path is None else ArtifactStore(path)
+    if store is None:
+        return []
+    sql = ("SELECT c.model AS model, COUNT(DISTINCT cmp.comparison_id) AS wins FROM comparisons cmp "
+           "JOIN candidates c ON c.sha256 = cmp.winner_sha256 AND c.section IS cmp.section WHERE 1 = 1")
+    params = []
+    for clause, value in (("cmp.chapter = ?", chapter), ("cmp.section LIKE ?", section_like), ("cmp.ts >= ?", since)):
+        if value is not None:
+            sql += f" AND {clause}"
+            params.append(value)
+    return store.query(sql + " GROUP BY c.model ORDER BY wins DESC", params)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["wins", "export", "query"])
+    parser.add_argument("--path", type=str, default=DEFAULT_STORE_PATH)
+    parser.add_argument("--chapter", type=str, default=None)
+    parser.add_argument("--section", type=str, default=None, help='小节的 LIKE 模式，如 "方法/%%"')
+    parser.add_argument("--days", type=float, default=None, help="只统计最近若干天")
+    parser.add_argument("--run", type=str, default=None, help="export 时只导出该运行 ID 的文件")
+    parser.add_argument("--target", type=str, default=".", help="export 的目标目录")
+    parser.add_argument("--sql", type=str, default=None)
+    args = parser.parse_args()
+    if args.action == "wins":
+        since = time.time() - args.days * 86400 if args.days else None
+        result = win_counts(args.chapter, args.section, since, path=args.path)
+    elif args.action == "export":
+        result = {"exported": ArtifactStore(args.path).export(args.target, args.run)}
+    else:
+        result = ArtifactStore(args.path).query(args.sql)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
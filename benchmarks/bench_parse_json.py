@@ -0,0 +1,104 @@
+"""
+parse_llm_json 的微基准：在带有长思维链的模拟响应上比较原有的括号配对实现与单遍扫描实现，
+并检查正文中大量未闭合括号（半开区间、孤立的 "{"）时扫描耗时仍随长度线性增长。
+
+用法：
+    python benchmarks/bench_parse_json.py --think_chars 200000 --repeat 20
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import parse_llm_json  # noqa: E402
+
+
+def legacy_parse_llm_json(text):
+    """改写前的实现（不区分字符串中的括号，只尝试第一个候选），仅用于对比。"""
+    s = text.strip()
+    m = re.search(r"```(?:json)?\s*(\{[\s\S]*\}|\[[\s\S]*\])\s*```", s, flags=re.IGNORECASE)
+    if m:
+        return json.loads(m.group(1).strip())
+    for start_char in ['{', '[']:
+        start_idx = s.find(start_char)
+        if start_idx == -1:
+            continue
+        stack = []
+        for i in range(start_idx, len(s)):
+            ch = s[i]
+            if ch == '{' or ch == '[':
+                stack.append(ch)
+            elif ch == '}' or ch == ']':
+                if not stack:
+                    break
+                stack.pop()
+                if not stack:
+                    return json.loads(s[start_idx:i + 1])
+    return json.loads(s)
+
+
+def make_response(think_chars, answer_chars, fenced):
+    """构造“思维链 + JSON 回答”形式的响应，思维链与回答字符串中都带有括号和代码块标记。"""
+    think_unit = "先分析草稿的结构 {段落1, 段落2}，再检查 [术语] 是否一致；``` 示例 ``` 不是最终答案。\n"
+    think = (think_unit * (think_chars // len(think_unit) + 1))[:think_chars]
+    revised = ("修订后的段落包含公式 f(x) = {x | x > 0} 与集合 [a, b]。" * (answer_chars // 30 + 1))[:answer_chars]
+    answer = json.dumps({"revised_text": revised, "severity": 2}, ensure_ascii=False)
+    if fenced:
+        answer = "```json\n" + answer + "\n```"
+    return f"<think>{think}</think>\n{answer}"
+
+
+def make_unclosed_response(prose_chars, unit):
+    """构造“大量未闭合括号的正文 + JSON 回答”形式的响应，如含半开区间 [0, 1) 的推导。"""
+    prose = (unit * (prose_chars // len(unit) + 1))[:prose_chars]
+    return prose + "\n" + json.dumps({"revised_text": "修订后的段落。", "severity": 2}, ensure_ascii=False)
+
+
+def bench(fn, text, repeat, **kwargs):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            result = fn(text, **kwargs)
+        except ValueError as e:
+            result = e
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--think_chars', type=int, nargs='+', default=[20000, 200000, 1000000])
+    parser.add_argument('--answer_chars', type=int, default=8000)
+    parser.add_argument('--unclosed_chars', type=int, nargs='+', default=[25000, 100000, 400000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'think_chars':>12} {'fenced':>7} {'legacy_ms':>10} {'legacy_ok':>9} {'scanner_ms':>10} {'scanner_ok':>10}")
+    for think_chars in args.think_chars:
+        for fenced in (False, True):
+            text = make_response(think_chars, args.answer_chars, fenced)
+            legacy_time, legacy_result = bench(legacy_parse_llm_json, text, args.repeat)
+            new_time, new_result = bench(parse_llm_json, text, args.repeat, expected_keys=("revised_text",))
+            legacy_ok = isinstance(legacy_result, dict) and "revised_text" in legacy_result
+            new_ok = isinstance(new_result, dict) and "revised_text" in new_result
+            print(f"{think_chars:>12} {str(fenced):>7} {legacy_time * 1000:>10.2f} {str(legacy_ok):>9} "
+                  f"{new_time * 1000:>10.2f} {str(new_ok):>10}")
+
+    print()
+    print(f"{'unclosed_chars':>14} {'prose':>12} {'scanner_ms':>10} {'scanner_ok':>10}")
+    for prose_chars in args.unclosed_chars:
+        for name, unit in (("half_open", "函数在区间 [0, 1) 上单调，"), ("open_brace", "x { ")):
+            text = make_unclosed_response(prose_chars, unit)
+            new_time, new_result = bench(parse_llm_json, text, args.repeat, expected_keys=("revised_text",))
+            new_ok = isinstance(new_result, dict) and "revised_text" in new_result
+            print(f"{prose_chars:>14} {name:>12} {new_time * 1000:>10.2f} {str(new_ok):>10}")
+
+
+if __name__ == '__main__':
+    main()
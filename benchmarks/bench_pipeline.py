@@ -0,0 +1,172 @@
+"""
+整章流水线的端到端基准：在本地模拟服务（mock_server.py）上运行真实的章节生成、best_of_N 评审与批评-修订，
+报告请求吞吐、整章耗时、关键路径与调度开销，用于离线发现并发与 I/O 方面的性能回退。
+
+流程：
+    1. 在临时目录中准备合成的 essay、样例与仓库中的提示词；
+    2. 启动模拟服务，生成指向它的 config.json 并通过 ESSAY4THESIS_CONFIG 启用；
+    3. 用 main.build_chapter_tasks 构建整章 DAG 并执行。
+
+用法：
+    python benchmarks/bench_pipeline.py --latency 0.3 --tokens_per_sec 300 --subsections 4 --workers 4
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockLLMServer, _text  # noqa: E402
+
+SUBSECTION_FILES = ("data/essays/essay1/method", "data/essays/essay1/exps")
+FIXTURE_FILES = (
+    "data/essays/example_essay_intro.txt", "data/essays/example_essay_abs.txt",
+    "data/essays/example_essay_method.txt", "data/essays/example_essay_exp.txt",
+    "data/essays/essay1/intro.txt", "data/essays/essay1/abs.txt",
+    "data/thesis/example_essay4thesis_前言.txt", "data/thesis/example_essay4thesis_引言.txt",
+    "data/thesis/example_essay4thesis_方法.txt", "data/thesis/example_essay4thesis_实验.txt",
+)
+
+
+def prepare_workspace(workspace, subsections, fixture_tokens):
+    """在 workspace 中生成流水线需要的输入文件，并复制仓库中的提示词。"""
+    shutil.copytree(os.path.join(REPO_DIR, "prompts"), os.path.join(workspace, "prompts"))
+    for path in FIXTURE_FILES:
+        full = os.path.join(workspace, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "w", encoding="utf-8") as f:
+            f.write(_text(fixture_tokens))
+    for directory in SUBSECTION_FILES:
+        os.makedirs(os.path.join(workspace, directory), exist_ok=True)
+        for i in range(subsections):
+            with open(os.path.join(workspace, directory, f"3.{i + 1}.txt"), "w", encoding="utf-8") as f:
+                # 各小节的 essay 从开头就互不相同，与真实输入一样不能共享前缀
+                f.write(f"【小节 3.{i + 1}】" + _text(fixture_tokens + i)[i:])
+
+
+def write_config(workspace, server_url, candidate_models, concurrency, prompt_layout="inline"):
+    """所有服务商都指向模拟服务，关闭响应缓存与限速，telemetry 写入临时目录。"""
+    import llm_registry
+    providers = {spec["provider"] for spec in llm_registry.DEFAULT_MODELS.values()}
+    config = {
+        "providers": {p: {"api_key": "mock", "base_url": server_url, "sdk": "openai"} for p in providers},
+        "candidate_models": candidate_models,
+        "concurrency": {p: concurrency for p in providers},
+        "cache": {"enabled": False},
+        "prompt_layout": prompt_layout,
+        "telemetry": {"path": os.path.join(workspace, "data/telemetry/llm_calls.jsonl")},
+    }
+    path = os.path.join(workspace, "config.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def scheduling_delays(tasks, report):
+    """每个节点从依赖全部完成到实际开始执行的等待时间（包含线程池排队与调度开销）。"""
+    delays = {}
+    for task in tasks:
+        r = report.get(task.name)
+        if not r or r["start"] is None:
+            continue
+        ready = max((report[d]["end"] for d in task.deps if report.get(d) and report[d]["end"] is not None),
+                    default=0.0)
+        delays[task.name] = max(0.0, r["start"] - ready)
+    return delays
+
+
+def run(args):
+    workspace = tempfile.mkdtemp(prefix="essay4thesis_bench_")
+    server = MockLLMServer(latency=args.latency, tokens_per_sec=args.tokens_per_sec, error_rate=args.error_rate,
+                           think_tokens=args.think_tokens, answer_tokens=args.answer_tokens,
+                           reasoning_field=args.reasoning_field, seed=args.seed).start()
+    cwd = os.getcwd()
+    try:
+        prepare_workspace(workspace, args.subsections, args.fixture_tokens)
+        os.environ["ESSAY4THESIS_CONFIG"] = write_config(workspace, server.url, args.candidate_models,
+                                                         args.concurrency, args.prompt_layout)
+        os.chdir(workspace)
+
+        import llm_registry
+        import telemetry
+        llm_registry.reset()
+        import main
+        from scheduler import run_dag, summarize
+
+        tasks = main.build_chapter_tasks(args.parts, critic_rounds=args.critic_rounds, critic_model=args.critic_model,
+                                         incremental=False)
+        start = time.monotonic()
+        report = run_dag(tasks, max_workers=args.workers)
+        wall_clock = time.monotonic() - start
+        summary = summarize(tasks, report)
+        delays = scheduling_delays(tasks, report)
+        server_stats = server.stats()
+        usage = telemetry.run_report()
+
+        result = {
+            "settings": vars(args),
+            "tasks": len(tasks),
+            "status": {s: sum(1 for r in report.values() if r["status"] == s) for s in ("done", "failed", "skipped")},
+            "wall_clock": wall_clock,
+            "critical_path_length": summary["critical_path_length"],
+            "sum_of_tasks": summary["sum_of_tasks"],
+            "parallelism": summary["sum_of_tasks"] / wall_clock if wall_clock else None,
+            # 整章耗时超出关键路径的部分，即并发不足或调度排队造成的损失
+            "scheduler_overhead": wall_clock - summary["critical_path_length"],
+            "scheduling_delay_mean": sum(delays.values()) / len(delays) if delays else None,
+            "scheduling_delay_max": max(delays.values()) if delays else None,
+            "requests": server_stats["requests"],
+            "requests_per_sec": server_stats["requests"] / wall_clock if wall_clock else None,
+            # 模拟服务统计的前缀缓存命中比例，与 usage 中 cached_tokens 汇总的结果应当一致
+            "prefix_cache_ratio": server_stats["cached_chars"] / max(1, server_stats["prompt_chars"]),
+            "server": server_stats,
+            "by_stage": telemetry.aggregate(telemetry.load_records(run_id=usage["run_id"]), ("stage",)),
+        }
+        return result
+    finally:
+        os.chdir(cwd)
+        server.stop()
+        if args.keep:
+            print(f"工作目录保留在 {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟服务的首 token 延迟（秒）")
+    parser.add_argument("--tokens_per_sec", type=float, default=500)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--think_tokens", type=int, default=100)
+    parser.add_argument("--answer_tokens", type=int, default=300)
+    parser.add_argument("--reasoning_field", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixture_tokens", type=int, default=2000, help="合成 essay 与样例的长度")
+    parser.add_argument("--subsections", type=int, default=3, help="方法、实验各自的小节数")
+    parser.add_argument("--parts", type=str, nargs="+", default=["前言", "引言", "方法", "实验"])
+    parser.add_argument("--candidate_models", type=str, nargs="+", default=["dsv3", "dsr1", "qwen3"])
+    parser.add_argument("--critic_rounds", type=int, default=2)
+    parser.add_argument("--critic_model", type=str, default="dsr1")
+    parser.add_argument("--workers", type=int, default=4, help="DAG 调度的并发节点数")
+    parser.add_argument("--concurrency", type=int, default=8, help="每个服务商的异步并发上限")
+    parser.add_argument("--prompt_layout", type=str, default="inline", choices=["inline", "prefix_cache"])
+    parser.add_argument("--output", type=str, default=None, help="将结果另存为 JSON")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录以便检查产物")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
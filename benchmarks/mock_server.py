@@ -0,0 +1,275 @@
+"""
+本地 OpenAI 兼容的模拟服务，用于在不消耗 API 费用的情况下测试整条流水线的吞吐。
+
+支持 /v1/chat/completions 的普通与流式（SSE）请求，可配置首 token 延迟、生成速度、错误率与 <think> 思维链输出，
+并模拟服务商的前缀缓存：与之前请求共享的前缀（按 PREFIX_BLOCK 个字符对齐）计入 usage 的 cached_tokens。
+回答内容按请求类型生成：批评请求返回 {"review", "severity"}，修订请求返回 {"revised_text"}，
+候选比较请求返回候选编号，其余请求返回一段随机正文（不同请求的正文互不相似，不会在评审前被当作近似重复合并）。
+
+用法：
+    python benchmarks/mock_server.py --port 8765 --latency 0.5 --tokens_per_sec 100 --error_rate 0.05
+然后在 config.json 中将服务商的 base_url 指向 http://127.0.0.1:8765/v1。
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = "本文提出一种基于生成不确定性估计的大模型幻觉检测方法，并在多个数据集上验证了其有效性。"
+
+
+# 前缀缓存的粒度（字符数），与服务商按固定 token 块缓存前缀的方式类似
+PREFIX_BLOCK = 64
+
+
+def _text(n_tokens):
+    """长度约为 n_tokens 个 token（按每个汉字一个 token 计）的正文。"""
+    return (FILLER * (n_tokens // len(FILLER) + 1))[:max(1, n_tokens)]
+
+
+class MockLLMServer:
+    """
+    参数：
+        latency (float): 首 token 之前的延迟（秒）。
+        tokens_per_sec (float): 生成速度，0 表示不限速。
+        error_rate (float): 以该概率返回 429（带 Retry-After）或 500 错误。
+        think_tokens (int): 思维链长度，0 表示不输出思维链。
+        answer_tokens (int): 正文长度。
+        reasoning_field (bool): 为 True 时思维链通过 reasoning_content 返回，否则以 <think>...</think> 写在 content 中。
+        prefix_cache (bool): 是否模拟前缀缓存。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, tokens_per_sec=200, error_rate=0.0,
+                 think_tokens=50, answer_tokens=300, reasoning_field=False, seed=None, prefix_cache=True):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.think_tokens = think_tokens
+        self.answer_tokens = answer_tokens
+        self.reasoning_field = reasoning_field
+        self.prefix_cache = prefix_cache
+        self._prefixes = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "streams": 0, "in_flight": 0, "max_in_flight": 0, "by_kind": {},
+                       "prompt_chars": 0, "cached_chars": 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+            if key == "in_flight":
+                self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def _cached_prefix(self, model, messages):
+        """返回请求与之前的请求（同一模型）共享的前缀长度（字符数），并记录本次请求的所有块对齐前缀。"""
+        text = model + "\x00" + "\x00".join(f"{m.get('role')}\x01{m.get('content') or ''}" for m in messages)
+        digest = hashlib.sha1()
+        hashes = []
+        for i in range(0, len(text) - PREFIX_BLOCK + 1, PREFIX_BLOCK):
+            digest.update(text[i:i + PREFIX_BLOCK].encode("utf-8"))
+            hashes.append(digest.copy().hexdigest())
+        with self._lock:
+            hit = 0
+            for n, h in enumerate(hashes):
+                if h not in self._prefixes:
+                    break
+                hit = (n + 1) * PREFIX_BLOCK
+            self._prefixes.update(hashes)
+            self._stats["prompt_chars"] += len(text)
+            self._stats["cached_chars"] += hit
+        return hit
+
+    # ---- 回答内容 ----
+
+    @staticmethod
+    def _kind(messages):
+        prompt = str(messages[-1].get("content") or "") if messages else ""
+        if "revised_text" in prompt:
+            return "improve"
+        if "`review`" in prompt:
+            return "critic"
+        if "candidates" in prompt:
+            return "judge"
+        return "generation"
+
+    def _answer(self, kind):
+        if kind == "critic":
+            return json.dumps({"review": _text(self.answer_tokens // 4), "severity": int(self._roll() * 4)},
+                              ensure_ascii=False)
+        if kind == "improve":
+            return json.dumps({"revised_text": _text(self.answer_tokens)}, ensure_ascii=False)
+        if kind == "judge":
+            return "1"
+        with self._lock:
+            return "".join(chr(0x4e00 + self._random.randrange(3000)) for _ in range(max(1, self.answer_tokens)))
+
+    def _pace(self, n_tokens):
+        if self.tokens_per_sec:
+            time.sleep(n_tokens / self.tokens_per_sec)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    request = {}
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                server._count("requests")
+                server._count("in_flight")
+                try:
+                    self._complete(request)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    server._count("in_flight", -1)
+
+            def _complete(self, request):
+                messages = request.get("messages") or []
+                kind = server._kind(messages)
+                with server._lock:
+                    server._stats["by_kind"][kind] = server._stats["by_kind"].get(kind, 0) + 1
+
+                if server.error_rate and server._roll() < server.error_rate:
+                    server._count("errors")
+                    time.sleep(server.latency / 4)
+                    if server._roll() < 0.5:
+                        self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                                        {"Retry-After": "0"})
+                    else:
+                        self._send_json(500, {"error": {"message": "mock server error", "type": "server_error"}})
+                    return
+
+                think = _text(server.think_tokens) if server.think_tokens else ""
+                answer = server._answer(kind)
+                model = request.get("model", "mock")
+                prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 2 + 1
+                cached_tokens = server._cached_prefix(model, messages) // 2 if server.prefix_cache else 0
+                usage = {"prompt_tokens": prompt_tokens,
+                         "completion_tokens": len(think) + len(answer),
+                         "total_tokens": prompt_tokens + len(think) + len(answer),
+                         "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)},
+                         "completion_tokens_details": {"reasoning_tokens": len(think)}}
+                completion_id = "chatcmpl-" + uuid.uuid4().hex[:12]
+                time.sleep(server.latency)
+
+                if not request.get("stream"):
+                    server._pace(len(think) + len(answer))
+                    message = {"role": "assistant", "content": answer}
+                    if think and server.reasoning_field:
+                        message["reasoning_content"] = think
+                    elif think:
+                        message["content"] = f"<think>{think}</think>{answer}"
+                    self._send_json(200, {"id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                                          "model": model, "usage": usage,
+                                          "choices": [{"index": 0, "message": message, "finish_reason": "stop"}]})
+                    return
+
+                server._count("streams")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def send(delta=None, finish_reason=None, usage_chunk=None):
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": []}
+                    if delta is not None:
+                        chunk["choices"] = [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                    if usage_chunk is not None:
+                        chunk["usage"] = usage_chunk
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                step = 16
+                send({"role": "assistant", "content": ""})
+                if think and server.reasoning_field:
+                    for i in range(0, len(think), step):
+                        server._pace(step)
+                        send({"reasoning_content": think[i:i + step]})
+                    content = answer
+                else:
+                    content = f"<think>{think}</think>{answer}" if think else answer
+                for i in range(0, len(content), step):
+                    server._pace(step)
+                    send({"content": content[i:i + step]})
+                send({}, finish_reason="stop")
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    send(usage_chunk=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="首 token 延迟（秒）")
+    parser.add_argument("--tokens_per_sec", type=float, default=200, help="生成速度，0 表示不限速")
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--think_tokens", type=int, default=50)
+    parser.add_argument("--answer_tokens", type=int, default=300)
+    parser.add_argument("--reasoning_field", action="store_true", help="通过 reasoning_content 返回思维链")
+    parser.add_argument("--no_prefix_cache", action="store_true", help="不模拟前缀缓存")
+    args = parser.parse_args()
+    mock = MockLLMServer(args.host, args.port, args.latency, args.tokens_per_sec, args.error_rate,
+                         args.think_tokens, args.answer_tokens, args.reasoning_field,
+                         prefix_cache=not args.no_prefix_cache)
+    print(f"mock server listening on {mock.url}")
+    try:
+        mock._httpd.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
@@ -1,89 +1,351 @@
 import os, re
+import asyncio
+import json
+import math
 import uuid
-from util import query_llm, load_prompt, remove_think_chain, save_to_file
+from statistics import NormalDist
+from util import aquery_llm, run_async, load_prompt, remove_think_chain, save_to_file, has_think_chain, estimate_tokens
+from prompt_template import load_template
+from context_budget import fit_prompt
+from dedup import cluster_candidates, dedup_settings
+from manifest import fingerprint, is_fresh, write_manifest
+import telemetry
+import artifact_store
+from manifest import hash_text
 from collections import Counter
 
 compare_prompt_path = "prompts/compare_candidates.txt"
 
-def best_of_N_candidates(candidates, sys_prompt_path, writing_prompt_path, essay_content_path, comparison_time, model="dsv3"):
+def _parse_selection(final_response, n_candidates):
+    """从模型返回中提取候选编号（从 1 开始），无效时返回 None。"""
+    if not final_response:
+        print("模型未返回有效响应。")
+        return None
+    try:
+        # 使用正则表达式提取数字
+        match = re.search(r"\b\d+\b", final_response)
+        if match:
+            selected_number = int(match.group())
+            if 1 <= selected_number <= n_candidates:
+                return selected_number
+            print(f"无效的编号: {selected_number}")
+        else:
+            print(f"未找到有效的编号: {final_response}")
+    except ValueError:
+        print(f"无法解析模型返回的编号: {final_response}")
+    return None
+
+def _should_stop(votes, remaining, confidence=None):
     """
-    从多个写作候选项中挑选出最优的一个。
+    判断是否可以提前结束投票。
 
-    参数：
-        candidates (list): 写作候选项列表。
-        sys_prompt_path (str): 系统提示词文件路径。
-        writing_prompt_path (str): 写作提示词文件路径。
-        comparison_time (int): 比较次数。
-        model (str): 使用的模型。
+    - 领先者票数超过第二名与剩余票数之和时，结果已无法被改变；
+    - 给定 confidence 时，若领先者得票率的 Wilson 置信下界超过 0.5，也提前结束。
+    """
+    ranked = votes.most_common(2)
+    if not ranked:
+        return False
+    leader = ranked[0][1]
+    second = ranked[1][1] if len(ranked) > 1 else 0
+    if leader > second + remaining:
+        return True
+    if confidence is not None:
+        n = sum(votes.values())
+        if n < 2:
+            return False
+        z = NormalDist().inv_cdf(confidence)
+        p = leader / n
+        lower = (p + z * z / (2 * n) - z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))) / (1 + z * z / n)
+        return lower > 0.5
+    return False
+
+def _build_compare_messages(sys_prompt, compare_prompt_template, writing_prompt, essay_content, candidates, model=None):
+    """
+    构建比较消息，候选项按列表顺序从 1 开始编号。
+
+    传入 model 时先检查上下文预算（见 context_budget.fit_prompt），超出时只缩减写作提示词；essay 与候选内容保持完整，
+    缩减后仍超出时抛出 ContextBudgetError。
+    """
+    candidates_text = "\n".join([f"Candidate {i+1}:\n{c}" for i, c in enumerate(candidates)])
+    fields = {
+        "writing_prompt": writing_prompt,
+        "essay_content": essay_content,
+        "candidates": candidates_text,
+    }
+    variable = ("essay_content", "candidates")
+    if model is None:
+        compare_prompt = compare_prompt_template.render(fields, variable=variable)
+    else:
+        compare_prompt, _ = fit_prompt(compare_prompt_template, fields, model, reducible=("writing_prompt",),
+                                       system_prompt=sys_prompt, stage="judge", variable=variable)
+    return [
+        {"role": "system", "content": sys_prompt},
+        {"role": "user", "content": compare_prompt}
+    ]
+
+async def _run_votes(messages, n_candidates, vote_count, model, output_prefix, parallel=None, confidence=None):
+    """
+    分批发起至多 vote_count 次比较投票，结果确定后不再发出新的投票。
+
+    只有当在途的投票即使全部投给当前领先者也无法决定结果时才发出新的投票：首批为刚好能形成多数的
+    vote_count // 2 + 1 次，结果一致时其余投票不会发出，也就不会产生费用。parallel 限制同时在途的投票数。
+    每次投票的原始响应保存为 f"{output_prefix}{序号}.txt"。
 
     返回：
-        str: 被选中的最优候选项。
+        tuple: (Counter{候选编号: 票数}, 已完成的投票数, 是否提前结束)
+    """
+    limit = parallel or vote_count
+
+    async def vote(index):
+        # 调用模型进行筛选；每次投票使用不同的缓存盐，保证缓存后仍是独立采样
+        with telemetry.tag(stage="judge"):
+            response = await aquery_llm(messages, model=model, cache_salt=f"{os.path.basename(output_prefix)}{index + 1}")
+        final_response = response
+        if has_think_chain(model) and response:
+            final_response = remove_think_chain(response)
+
+        selected = _parse_selection(final_response, n_candidates)
+        artifact_store.save_backup(f"{output_prefix}{index + 1}.txt", response or "")
+        artifact_store.add("votes", comparison_id=os.path.basename(os.path.dirname(output_prefix)), judge_model=model,
+                           vote_index=index + 1, selected=selected, path=f"{output_prefix}{index + 1}.txt")
+        return selected
+
+    # 统计每个候选项被选中的次数
+    votes = Counter()
+    pending = set()
+    launched = 0
+    finished = 0
+    stopped_early = False
+
+    def decidable_in_flight():
+        ranked = votes.most_common(2)
+        leader = ranked[0][1] if ranked else 0
+        second = ranked[1][1] if len(ranked) > 1 else 0
+        return leader + len(pending) > second + (vote_count - finished - len(pending))
+
+    def top_up():
+        nonlocal launched
+        while launched < vote_count and len(pending) < limit and not decidable_in_flight():
+            pending.add(asyncio.create_task(vote(launched)))
+            launched += 1
+
+    try:
+        top_up()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+                finished += 1
+                selected_number = task.result()
+                if selected_number is not None:
+                    votes[selected_number] += 1
+            if finished < vote_count and _should_stop(votes, vote_count - finished, confidence):
+                stopped_early = True
+                break
+            top_up()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return votes, finished, stopped_early
+
+async def _select_all_in_one(candidates, sys_prompt, compare_prompt_template, writing_prompt, essay_content,
+                             comparison_dir, comparison_time, model, parallel, confidence):
+    """将全部候选项放入同一个比较提示词中，重复投票 comparison_time 次。"""
+    messages = _build_compare_messages(sys_prompt, compare_prompt_template, writing_prompt, essay_content, candidates, model)
+    votes, finished, stopped_early = await _run_votes(messages, len(candidates), comparison_time, model,
+                                                      f"{comparison_dir}/comparison_", parallel, confidence)
+    if stopped_early:
+        print(f"投票在 {finished}/{comparison_time} 次后提前结束: {dict(votes)}")
+    most_common = votes.most_common(1)
+    winner = most_common[0][0] if most_common else None
+    judge_tokens = estimate_tokens(messages) * finished
+    return winner, votes, {"finished": finished, "stopped_early": stopped_early, "judge_tokens": judge_tokens}
+
+async def _select_knockout(candidates, sys_prompt, compare_prompt_template, writing_prompt, essay_content,
+                           comparison_dir, match_votes, group_size, model, parallel, confidence):
+    """
+    淘汰赛：每轮将剩余候选项按 group_size 分组，各组并发比较，组内胜者晋级，直到只剩一个。
+
+    每个比较请求只包含一组候选项，单次请求远小于全部候选项放在一起的提示词。
+    """
+    if group_size < 2:
+        raise ValueError("group_size 必须不小于 2")
+    alive = list(range(1, len(candidates) + 1))
+    votes = Counter()
+    bracket = []
+    judge_tokens = 0
+    round_index = 0
+    while len(alive) > 1:
+        round_index += 1
+        groups = [alive[i:i + group_size] for i in range(0, len(alive), group_size)]
+
+        async def play(match_index, group):
+            # 只剩一个候选项的组直接晋级
+            if len(group) == 1:
+                return group[0], Counter(), 0
+            messages = _build_compare_messages(sys_prompt, compare_prompt_template, writing_prompt, essay_content,
+                                               [candidates[n - 1] for n in group], model)
+            match_result, finished, _ = await _run_votes(
+                messages, len(group), match_votes, model,
+                f"{comparison_dir}/round_{round_index}_match_{match_index + 1}_", parallel, confidence)
+            ranked = match_result.most_common(1)
+            # 全部投票无效时保留组内第一个候选项
+            winner = group[ranked[0][0] - 1] if ranked else group[0]
+            return winner, Counter({group[k - 1]: v for k, v in match_result.items()}), estimate_tokens(messages) * finished
+
+        results = await asyncio.gather(*(play(i, g) for i, g in enumerate(groups)))
+        alive = []
+        for group, (winner, match_votes_received, tokens) in zip(groups, results):
+            alive.append(winner)
+            votes.update(match_votes_received)
+            judge_tokens += tokens
+            bracket.append({"round": round_index, "group": group, "winner": winner, "votes": dict(match_votes_received)})
+
+    winner = alive[0] if alive else None
+    return winner, votes, {"bracket": bracket, "judge_tokens": judge_tokens}
+
+def _renumber(info, votes, winner, clusters):
+    """将代表候选的编号（从 1 开始）换回原候选列表中的编号。"""
+    original = [c["representative"] + 1 for c in clusters]
+    votes = Counter({original[k - 1]: v for k, v in votes.items()})
+    winner = original[winner - 1] if winner is not None else None
+    for match in info.get("bracket", []):
+        match["group"] = [original[n - 1] for n in match["group"]]
+        match["winner"] = original[match["winner"] - 1]
+        match["votes"] = {original[k - 1]: v for k, v in match["votes"].items()}
+    return votes, winner
+
+async def abest_of_N_candidates(candidates, sys_prompt_path, writing_prompt_path, essay_content_path, comparison_time, model="dsv3", parallel=None, confidence=None, return_votes=False, strategy="all_in_one", group_size=2, match_votes=1, dedup=None):
+    """
+    best_of_N_candidates 的异步版本，参数与 best_of_N_candidates 相同。
     """
     # 加载系统提示词和写作提示词
     sys_prompt = load_prompt(sys_prompt_path)
     writing_prompt = load_prompt(writing_prompt_path)
     essay_content = load_prompt(essay_content_path)
-    compare_prompt_template = load_prompt(compare_prompt_path)
-
-    # 构建比较提示词
-    candidates_text = "\n".join([f"Candidate {i+1}:\n{c}" for i, c in enumerate(candidates)])
-    compare_prompt = compare_prompt_template.replace("{sys_prompt}", sys_prompt)
-    compare_prompt = compare_prompt.replace("{writing_prompt}", writing_prompt)
-    compare_prompt = compare_prompt.replace("{essay_content}", essay_content)
-    compare_prompt = compare_prompt.replace("{candidates}", candidates_text)
-
-    # 记录每次筛选的结果
-    selection_results = []
+    compare_prompt_template = load_template(compare_prompt_path)
 
     # 生成唯一的运行 ID
     run_id = str(uuid.uuid4())
     comparison_dir = f"data/backups/candidate_comparison/{run_id}"
-    os.makedirs(comparison_dir, exist_ok=True)
-
-    for _ in range(comparison_time):
-        # 构建消息
-        messages = [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": compare_prompt}
-        ]
 
-        # 调用模型进行筛选
-        response = query_llm(messages, model=model)
-        final_response = response
-        if model in ["dsr1","gemini-2.5-pro","qwen3"]:
-            final_response = remove_think_chain(response)
+    # 近似重复的候选只保留组内第一个作为代表参与评审，避免重复内容拉长提示词并分散票数
+    if dedup is None:
+        dedup = dedup_settings()["enabled"]
+    if dedup:
+        clusters = cluster_candidates(candidates)
+    else:
+        clusters = [{"representative": i, "members": [i], "similarity": {}} for i in range(len(candidates))]
+    representatives = [candidates[c["representative"]] for c in clusters]
+    for c in clusters:
+        for i, similarity in c["similarity"].items():
+            print(f"候选 {i + 1} 与候选 {c['representative'] + 1} 近似重复（相似度 {similarity:.2f}），只评审后者")
 
-        comparison_output_path = f"{comparison_dir}/comparison_{_ + 1}.txt"
-        save_to_file(response, comparison_output_path)
-
-        # 提取模型返回的编号
-        if final_response:
-            try:
-                # 使用正则表达式提取数字
-                match = re.search(r"\b\d+\b", final_response)
-                if match:
-                    selected_number = int(match.group())
-                    if 1 <= selected_number <= len(candidates):
-                        selection_results.append(selected_number)
-                    else:
-                        print(f"无效的编号: {selected_number}")
-                else:
-                    print(f"未找到有效的编号: {response}")
-            except ValueError:
-                print(f"无法解析模型返回的编号: {response}")
-        else:
-            print("模型未返回有效响应。")
+    if strategy not in ("all_in_one", "knockout"):
+        raise ValueError("strategy 必须是 'all_in_one' 或 'knockout'")
+    if len(representatives) == 1:
+        # 所有候选近似相同，无需评审
+        winner, votes, info = 1, Counter(), {"judge_tokens": 0, "skipped": "all candidates are near-duplicates"}
+    elif strategy == "all_in_one":
+        winner, votes, info = await _select_all_in_one(
+            representatives, sys_prompt, compare_prompt_template, writing_prompt, essay_content,
+            comparison_dir, comparison_time, model, parallel, confidence)
+    elif strategy == "knockout":
+        winner, votes, info = await _select_knockout(
+            representatives, sys_prompt, compare_prompt_template, writing_prompt, essay_content,
+            comparison_dir, match_votes, group_size, model, parallel, confidence)
+        # 记录同样投票次数下全量提示词的估计开销，便于对比
+        full_messages = _build_compare_messages(sys_prompt, compare_prompt_template, writing_prompt, essay_content, representatives)
+        info["all_in_one_judge_tokens"] = estimate_tokens(full_messages) * comparison_time
+        print(f"淘汰赛评审估计消耗 {info['judge_tokens']} tokens（全量比较约 {info['all_in_one_judge_tokens']} tokens）")
 
-    # 统计每个候选项被选中的次数
-    most_common = Counter(selection_results).most_common(1)
+    # 投票与淘汰赛记录中的编号均为原候选列表中的编号（从 1 开始）
+    votes, winner = _renumber(info, votes, winner, clusters)
+    info.update({"strategy": strategy, "votes": dict(votes), "winner": winner,
+                 "clusters": [{"representative": c["representative"] + 1,
+                               "members": [i + 1 for i in c["members"]],
+                               "similarity": {i + 1: s for i, s in c["similarity"].items()}} for c in clusters]})
+    artifact_store.save_backup(f"{comparison_dir}/votes.json", info)
+    artifact_store.add("comparisons", comparison_id=run_id, judge_model=model, strategy=strategy,
+                       n_candidates=len(candidates), winner=winner,
+                       winner_sha256=hash_text(candidates[winner - 1]) if winner is not None else None,
+                       info=json.dumps(info, ensure_ascii=False))
 
-    if most_common:
-        best_candidate_index = most_common[0][0] - 1  # 转换为 0 索引
-        return candidates[best_candidate_index]
+    if winner is not None:
+        best_candidate = candidates[winner - 1]  # 转换为 0 索引
     else:
         print("未能选出最优候选项。")
-        return None
+        best_candidate = None
+    return (best_candidate, dict(votes)) if return_votes else best_candidate
+
+def best_of_N_candidates(candidates, sys_prompt_path, writing_prompt_path, essay_content_path, comparison_time, model="dsv3", parallel=None, confidence=None, return_votes=False, strategy="all_in_one", group_size=2, match_votes=1, dedup=None):
+    """
+    从多个写作候选项中挑选出最优的一个。
+
+    比较投票分批并发执行：先发出刚好能形成多数的票数，结果未定时再补发；当领先的候选项已无法被超越，
+    或其得票率的置信下界超过 0.5 时，不再发出新的投票并取消尚未完成的投票。
+    评审前先按 shingle Jaccard 相似度合并近似重复的候选（见 dedup.cluster_candidates），每组只有代表参与评审，
+    分组情况记录在 votes.json 的 "clusters" 中。
+
+    参数：
+        candidates (list): 写作候选项列表。
+        sys_prompt_path (str): 系统提示词文件路径。
+        writing_prompt_path (str): 写作提示词文件路径。
+        comparison_time (int): 比较次数（投票上限）。
+        model (str): 使用的模型。
+        parallel (int): 同时在途的投票数上限，默认不限；无论是否设置，都只在已发出的投票不足以决定结果时才发出新的投票。
+        confidence (float): 提前结束所需的置信水平（如 0.9），为 None 时只在结果无法改变时提前结束。
+        return_votes (bool): 为 True 时同时返回投票分布。
+        strategy (str): "all_in_one" 将所有候选项放入同一提示词比较；
+            "knockout" 以淘汰赛方式分组比较，每个请求只包含 group_size 个候选项。
+        group_size (int): 淘汰赛每组的候选项数。
+        match_votes (int): 淘汰赛中每组比较的投票次数。
+        dedup (bool): 是否合并近似重复的候选，默认取 config.json 中 "dedup" 的 enabled。
+
+    返回：
+        str: 被选中的最优候选项；return_votes 为 True 时返回 (最优候选项, {候选编号: 票数})。
+    """
+    return run_async(abest_of_N_candidates(candidates, sys_prompt_path, writing_prompt_path, essay_content_path,
+                                             comparison_time, model=model, parallel=parallel,
+                                             confidence=confidence, return_votes=return_votes,
+                                             strategy=strategy, group_size=group_size, match_votes=match_votes,
+                                             dedup=dedup))
     
+def select_best_candidate(candidates, sys_prompt_path, writing_prompt_path, essay_content_path, best_output_path, comparison_time=5, model="dsr1", incremental=True, model_names=None, **selection_options):
+    """
+    用 best_of_N_candidates 选出最佳候选并保存到 best_output_path。
+
+    incremental 为 True 时，若候选内容、提示词、essay 与评审模型均未变化，则直接返回上次的结果，不再评审。
+    model_names 为生成候选的模型，记录在 manifest 中，供 portfolio.select_models 在增量构建时沿用。
+    selection_options 会原样传给 best_of_N_candidates（如 strategy、confidence）。
+    """
+    build_inputs = fingerprint(
+        files={"sys_prompt": sys_prompt_path, "writing_prompt": writing_prompt_path,
+               "essay_content": essay_content_path, "compare_prompt": compare_prompt_path},
+        values={"candidates": candidates, "model": model, "comparison_time": comparison_time,
+                "selection_options": selection_options, "dedup": dedup_settings()})
+    if incremental and is_fresh(best_output_path, build_inputs):
+        print(f"输入未变化，跳过 {best_output_path}")
+        return load_prompt(best_output_path)
+
+    best_candidate = best_of_N_candidates(
+        candidates,
+        sys_prompt_path,
+        writing_prompt_path,
+        essay_content_path,
+        comparison_time=comparison_time,
+        model=model,
+        **selection_options
+    )
+
+    # 保存最佳候选内容
+    save_to_file(best_candidate, best_output_path)
+    write_manifest(best_output_path, build_inputs, model=model, models=model_names)
+
+    print(f"最佳候选内容已保存到 {best_output_path}")
+    return best_candidate
+
 def load_and_compare_candidates(candidate_files,sys_prompt_path, writing_prompt_path, essay_content_path, best_output_path, model="dsr1"):
     candidates = []
     for file_path in candidate_files:
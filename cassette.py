@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+
+import llm_cache
+
+DEFAULT_CASSETTE_DIR = "data/cassettes"
+MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(RuntimeError):
+    """回放模式下找不到与请求匹配的录制记录。"""
+
+
+class Cassette:
+    """
+    LLM 请求/响应的录制与回放。
+
+    请求按（服务商模型名、消息、采样参数、缓存盐）计算键，每个键的响应按调用顺序保存在
+    <cassette_dir>/<key>.json 中；回放时同一请求的第 n 次调用返回第 n 条录制的响应，与并发执行的先后顺序无关。
+    回放时不访问网络，也不读写响应缓存；找不到对应记录时抛出 CassetteMiss。
+    """
+
+    def __init__(self, mode="off", cassette_dir=DEFAULT_CASSETTE_DIR):
+        if mode not in MODES:
+            raise ValueError(f"cassette mode 必须是 {MODES} 之一")
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+        self.lock = threading.Lock()
+        # 本进程中每个键已经使用的次数；录制时首次写入某个键会覆盖旧录制
+        self.calls = {}
+        self.loaded = {}
+
+    def _path(self, key):
+        return os.path.join(self.cassette_dir, key + ".json")
+
+    def _load(self, key):
+        if key not in self.loaded:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    self.loaded[key] = json.load(f)
+            except (OSError, ValueError):
+                self.loaded[key] = None
+        return self.loaded[key]
+
+    @staticmethod
+    def key(model_name, messages, params=None, cache_salt=None):
+        key_params = dict(params or {})
+        if cache_salt is not None:
+            key_params["__cache_salt__"] = cache_salt
+        return llm_cache.make_key(model_name, messages, key_params)
+
+    def replay(self, key, model):
+        """返回该请求下一次调用对应的录制响应，没有时抛出 CassetteMiss。"""
+        with self.lock:
+            index = self.calls.get(key, 0)
+            self.calls[key] = index + 1
+            record = self._load(key)
+        responses = (record or {}).get("responses", [])
+        if index >= len(responses):
+            raise CassetteMiss(f"回放模式下没有匹配的录制：模型 {model}，请求 {key[:12]}… 第 {index + 1} 次调用"
+                               f"（已录制 {len(responses)} 次），请先以 record 模式运行")
+        return responses[index]
+
+    def record(self, key, model, messages, content):
+        """追加一条响应；本进程第一次录制某个请求时覆盖旧文件，重新录制不会与旧记录混在一起。"""
+        with self.lock:
+            first = key not in self.calls
+            self.calls[key] = self.calls.get(key, 0) + 1
+            record = None if first else self.loaded.get(key)
+            if record is None:
+                preview = str(messages[-1].get("content") or "")[:200] if messages else ""
+                record = {"model": model, "request_preview": preview, "responses": []}
+            record["responses"].append(content)
+            self.loaded[key] = record
+            os.makedirs(self.cassette_dir, exist_ok=True)
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self._path(key))
+
+
+_cassette = Cassette()
+
+
+def configure(cassette_settings):
+    """
+    根据 config.json 中的 "cassette" 配置录制/回放：
+        {"mode": "record", "dir": "data/cassettes"}
+    环境变量 ESSAY4THESIS_CASSETTE（off/record/replay）与 ESSAY4THESIS_CASSETTE_DIR 优先于配置文件。
+    """
+    global _cassette
+    cassette_settings = cassette_settings or {}
+    mode = os.environ.get("ESSAY4THESIS_CASSETTE", cassette_settings.get("mode", "off"))
+    cassette_dir = os.environ.get("ESSAY4THESIS_CASSETTE_DIR", cassette_settings.get("dir", DEFAULT_CASSETTE_DIR))
+    _cassette = Cassette(mode, cassette_dir)
+
+
+def get_cassette():
+    return _cassette
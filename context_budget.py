@@ -0,0 +1,159 @@
+import threading
+
+import llm_registry
+from rate_limit import estimate_tokens
+
+# 各模型的上下文长度（token），可在 config.json 的 "models" 中用 "context_window" 覆盖或为新模型配置
+DEFAULT_CONTEXT_WINDOWS = {
+    "doubao": 32768,
+    "qwen3": 32768,
+    "dsv3": 65536,
+    "dsr1": 65536,
+    "gpt-4.1": 1047576,
+    "gemini-2.0-flash": 1048576,
+    "gemini-2.5-pro": 1048576,
+}
+DEFAULT_CONTEXT_WINDOW = 32768
+
+# config.json 中 "context_budget" 的默认值：
+#   reserve_output: 为输出（含思维链）预留的 token 数，可在 "models" 中用 "max_output_tokens" 按模型覆盖
+#   policies: 超出预算时依次尝试的缩减方式：truncate（截断）、drop（省略）、summarise（调用 summary_model 摘要）
+#   min_keep: truncate 时每个字段至少保留的比例
+DEFAULT_BUDGET_SETTINGS = {
+    "reserve_output": 8192,
+    "safety_margin": 0.05,
+    "policies": ["truncate", "drop"],
+    "min_keep": 0.3,
+    "summary_model": "dsv3",
+}
+
+TRUNCATED_MARK = "\n……（以下内容因上下文长度限制已截断）"
+DROPPED_MARK = "（该部分因上下文长度限制已省略）"
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+class ContextBudgetError(ValueError):
+    """提示词在应用全部缩减策略后仍超出模型的上下文预算。"""
+
+
+def budget_settings():
+    settings = dict(DEFAULT_BUDGET_SETTINGS)
+    settings.update(llm_registry.get_settings().get("context_budget", {}))
+    return settings
+
+
+def context_window(model):
+    return llm_registry.model_spec(model).get("context_window", DEFAULT_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW))
+
+
+def prompt_limit(model):
+    """模型可用于提示词的 token 数：上下文长度减去输出预留，再留出 safety_margin 的余量。"""
+    settings = budget_settings()
+    reserve = llm_registry.model_spec(model).get("max_output_tokens", settings["reserve_output"])
+    return int((context_window(model) - reserve) * (1 - settings["safety_margin"]))
+
+
+def _encoding(name):
+    """按名称加载 tiktoken 编码；未安装 tiktoken 时返回 None。"""
+    with _encodings_lock:
+        if name not in _encodings:
+            try:
+                import tiktoken
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception:
+                _encodings[name] = None
+        return _encodings[name]
+
+
+def count_tokens(text, model):
+    """
+    按模型族计算 token 数。
+
+    模型配置中的 "tokenizer" 可指定 tiktoken 编码名（如 "o200k_base"）或 "heuristic"；
+    未配置时 OpenAI 模型使用 o200k_base，其余模型（DeepSeek、Qwen、Gemini、豆包）没有公开的本地分词器，
+    使用 rate_limit.estimate_tokens 的估计（中文按每字 1 个 token，偏保守）。
+    """
+    spec = llm_registry.model_spec(model)
+    tokenizer = spec.get("tokenizer", "o200k_base" if spec["provider"] == "openai" else "heuristic")
+    if isinstance(text, list):
+        text = "".join(str(m.get("content") or "") for m in text)
+    encoding = _encoding(tokenizer) if tokenizer != "heuristic" else None
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text or "", disallowed_special=()))
+
+
+def _summarise(text, target_tokens, model):
+    from util import query_llm
+    import telemetry
+    prompt = (f"请将以下内容压缩到约 {target_tokens} 字以内，保留关键术语、结构与写作风格，只输出压缩后的内容：\n\n{text}")
+    with telemetry.tag(stage="summarise"):
+        summary = query_llm(prompt, model=model, remove_think=True)
+    return summary or text
+
+
+def fit_prompt(template, fields, model, reducible=(), system_prompt="", stage=None, variable=()):
+    """
+    渲染提示词并检查是否超出模型的上下文预算，超出时按 config 中的 policies 缩减 reducible 中的字段。
+
+    参数：
+        template (PromptTemplate): 提示词模板。
+        fields (dict): 占位符内容。
+        model (str): 模型别名，决定分词方式与上下文长度。
+        reducible (tuple): 可以缩减的字段，按优先级从低到高排列（先缩减排在前面的字段）；未列出的字段（如用户 essay、草稿）不会被修改。
+        system_prompt (str): 系统提示词，计入预算。
+        stage (str): 阶段名称，仅用于日志。
+        variable (tuple): 传给 PromptTemplate.render 的可变字段。
+
+    返回：
+        tuple: (渲染后的提示词, 预算报告 dict：limit、original、used、reductions)。
+
+    异常：
+        ContextBudgetError: 应用全部策略后仍超出预算。
+    """
+    settings = budget_settings()
+    limit = prompt_limit(model)
+    fields = dict(fields)
+    system_tokens = count_tokens(system_prompt, model)
+
+    def measure():
+        text = template.render(fields, variable=variable)
+        return text, system_tokens + count_tokens(text, model)
+
+    prompt, used = measure()
+    report = {"stage": stage, "model": model, "limit": limit, "original": used, "used": used, "reductions": []}
+
+    for policy in settings["policies"]:
+        for name in reducible:
+            if used <= limit:
+                break
+            value = str(fields.get(name) or "")
+            tokens = count_tokens(value, model)
+            if not value or tokens == 0:
+                continue
+            over = used - limit
+            if policy == "truncate":
+                # 截断标记本身也占用 token
+                keep = max(int(tokens * settings["min_keep"]), tokens - over - count_tokens(TRUNCATED_MARK, model))
+                if keep >= tokens:
+                    continue
+                fields[name] = value[:int(len(value) * keep / tokens)] + TRUNCATED_MARK
+            elif policy == "drop":
+                fields[name] = DROPPED_MARK
+            elif policy == "summarise":
+                target = max(int(tokens * settings["min_keep"]), tokens - over)
+                fields[name] = _summarise(value, target, settings["summary_model"])
+            else:
+                raise ValueError(f"未知的上下文缩减策略: {policy}")
+            prompt, new_used = measure()
+            report["reductions"].append({"policy": policy, "field": name, "saved": used - new_used})
+            used = new_used
+    report["used"] = used
+
+    reduced = "，".join(f"{r['policy']} {r['field']} -{r['saved']}" for r in report["reductions"])
+    print(f"[budget] {stage or '-'} {model}: {used}/{limit} tokens" + (f"（原 {report['original']}，{reduced}）" if reduced else ""))
+    if used > limit:
+        raise ContextBudgetError(f"{stage or '提示词'} 需要 {used} tokens，超出 {model} 的上下文预算 {limit}")
+    return prompt, report
@@ -1,164 +1,199 @@
 import os
+import glob
 import json
 import time
-from typing import Optional
-from util import load_prompt, query_llm, remove_think_chain, parse_llm_json
+import difflib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+from util import load_prompt, query_llm, remove_think_chain, parse_llm_json, repair_json, estimate_tokens
+from retry import FATAL, RETRYABLE, backoff_delay, classify_error
+from prompt_template import PromptTemplate, load_template, as_template
+from context_budget import fit_prompt
+from manifest import fingerprint, is_fresh, read_manifest, write_manifest
+import telemetry
+import artifact_store
+from cassette import CassetteMiss
 
 # 简洁一致的实现，使用 4 空格缩进，避免重复定义
 RETRY_COUNT = 3
-RETRY_DELAY = 5
+# 限速、网络与服务端错误的指数退避参数（秒），实际等待时间带随机抖动，并至少为 Retry-After
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 60
+
+# 收敛判定的默认值：相邻两轮草稿的改动比例低于 MIN_CHANGE，或批评者给出的 severity 不高于
+# STOP_SEVERITY（0 表示没有实质问题）时提前停止
+MIN_CHANGE = 0.02
+STOP_SEVERITY = 1
+
+def _save_text(path: Optional[str], text: str) -> None:
+    # 每轮的中间结果写入 artifact_store 的 files 表，backup_files 为 true 时同时写入文件
+    artifact_store.save_backup(path, text)
+
+
+def _save_json(path: Optional[str], data) -> None:
+    artifact_store.save_backup(path, data)
+
+
+def _parse_with_repair(text: str, save_failed_path: Optional[str] = None, expected_keys=None):
+    """Parse the JSON in `text`; if that fails, retry once on the locally repaired text before giving up."""
+    try:
+        return parse_llm_json(text, expected_keys=expected_keys)
+    except ValueError as e:
+        try:
+            parsed = parse_llm_json(repair_json(text), expected_keys=expected_keys)
+            print('JSON 解析失败，已在本地修复后解析成功')
+            return parsed
+        except ValueError:
+            _save_text(save_failed_path, text)
+            raise e
+
+
+def _query_and_parse(messages: List[dict],
+                     model: str,
+                     *,
+                     clean: bool = False,
+                     expected_keys=None,
+                     usage: Optional[dict] = None,
+                     save_raw_path: Optional[str] = None,
+                     save_failed_path: Optional[str] = None) -> Tuple[str, object]:
+    """Query the model and parse its JSON reply, retrying according to the error class.
+
+    Rate-limit, network and server errors are retried with jittered exponential backoff
+    (honouring Retry-After). A reply whose JSON cannot be parsed even after local repair is
+    re-queried without waiting (skipping the response cache); other errors (e.g. 400/401) are raised immediately.
+    Returns (text, parsed), where text has the think chain removed when clean=True.
+    """
+    for attempt in range(1, RETRY_COUNT + 1):
+        try:
+            with telemetry.tag(retries=attempt - 1):
+                # 重试时跳过响应缓存：无法解析的回复已被缓存，命中它只会得到同样的结果
+                resp = query_llm(messages, model=model, raise_on_error=True,
+                                 cache='use' if attempt == 1 else 'refresh')
+            raw = str(resp) if resp is not None else ''
+            if usage is not None:
+                usage['tokens'] = usage.get('tokens', 0) + estimate_tokens(messages) + estimate_tokens(raw)
+            _save_text(save_raw_path, raw)
+            text = remove_think_chain(raw) if clean else raw
+            return text, _parse_with_repair(text, save_failed_path=save_failed_path, expected_keys=expected_keys)
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == FATAL or attempt == RETRY_COUNT:
+                raise
+            if kind in RETRYABLE:
+                delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, e)
+                print(f'{model} 调用失败（{kind}），{delay:.1f}s 后重试: {e}')
+                time.sleep(delay)
+            else:
+                print(f'{model} 返回的 JSON 无法解析，重新请求: {e}')
+
 
 def critic(draft_text: str,
            essay_text: str,
            draft_example_text: str,
            draft_prompt :str,
-           critic_prompt: str,
+           critic_prompt: Union[str, PromptTemplate],
            system_prompt: str,
            model: str = 'dsr1',
            *,
            save_raw_path: Optional[str] = None,
            save_json_path: Optional[str] = None,
            save_review_path: Optional[str] = None,
-           save_failed_path: Optional[str] = None) -> Optional[str]:
-    """Call LLM as critic, parse JSON, save raw/json/review and return review text or None."""
-    prompt_filled = critic_prompt.replace('{博士论文草稿}', draft_text)
-    prompt_filled = prompt_filled.replace('{essay内容}', essay_text or '')
-    prompt_filled = prompt_filled.replace('{参考博士论文模板}', draft_example_text or '')
-    prompt_filled = prompt_filled.replace('{博士论文写作指令}', draft_prompt or '')
+           save_failed_path: Optional[str] = None,
+           usage: Optional[dict] = None,
+           return_json: bool = False) -> Union[Optional[str], Tuple[Optional[str], Optional[dict]]]:
+    """Call LLM as critic, parse JSON, save raw/json/review and return review text or None.
+
+    With return_json=True, returns (review, parsed JSON) so callers can read optional fields
+    such as severity/score. If `usage` is given, estimated tokens are added to usage['tokens'].
+    """
+    prompt_filled, _ = fit_prompt(as_template(critic_prompt, 'critic_prompt'), {
+        '博士论文草稿': draft_text,
+        'essay内容': essay_text or '',
+        '参考博士论文模板': draft_example_text or '',
+        '博士论文写作指令': draft_prompt or '',
+    }, model, reducible=('参考博士论文模板', '博士论文写作指令'),
+        system_prompt=system_prompt, stage='critic', variable=('博士论文草稿', 'essay内容'))
 
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt_filled},
     ]
 
-    last_exc = None
-    for attempt in range(1, RETRY_COUNT + 1):
-        try:
-            resp = query_llm(messages, model=model)
-            raw = str(resp) if resp is not None else ''
+    try:
+        with telemetry.tag(stage='critic'):
+            _, parsed = _query_and_parse(messages, model, expected_keys=('review',), usage=usage,
+                                         save_raw_path=save_raw_path, save_failed_path=save_failed_path)
+    except CassetteMiss:
+        # 回放模式下缺少录制说明请求与录制时不同，直接报错而不是当作一次失败的调用
+        raise
+    except Exception as e:
+        _save_json(save_json_path, {'__parse_error__': str(e), '__error_kind__': classify_error(e)})
+        return (None, None) if return_json else None
 
-            if save_raw_path:
-                try:
-                    os.makedirs(os.path.dirname(save_raw_path), exist_ok=True)
-                    with open(save_raw_path, 'w', encoding='utf-8') as f:
-                        f.write(raw)
-                except Exception:
-                    pass
-
-            parsed = parse_llm_json(raw, save_failed_path=save_failed_path)
-
-            if save_json_path:
-                try:
-                    os.makedirs(os.path.dirname(save_json_path), exist_ok=True)
-                    with open(save_json_path, 'w', encoding='utf-8') as f:
-                        json.dump(parsed, f, ensure_ascii=False, indent=2)
-                except Exception:
-                    pass
-
-            review = None
-            if isinstance(parsed, dict):
-                review = parsed.get('review')
-
-            if save_review_path and review is not None:
-                try:
-                    os.makedirs(os.path.dirname(save_review_path), exist_ok=True)
-                    with open(save_review_path, 'w', encoding='utf-8') as f:
-                        f.write(review)
-                except Exception:
-                    pass
-
-            return review
-        except Exception as e:
-            last_exc = e
-            if attempt < RETRY_COUNT:
-                time.sleep(RETRY_DELAY)
-                continue
-            if save_json_path:
-                try:
-                    os.makedirs(os.path.dirname(save_json_path), exist_ok=True)
-                    with open(save_json_path, 'w', encoding='utf-8') as f:
-                        json.dump({'__parse_error__': str(last_exc)}, f, ensure_ascii=False, indent=2)
-                except Exception:
-                    pass
-            return None
+    _save_json(save_json_path, parsed)
+
+    review = None
+    if isinstance(parsed, dict):
+        review = parsed.get('review')
+
+    if review is not None:
+        _save_text(save_review_path, review)
+
+    if return_json:
+        return review, parsed if isinstance(parsed, dict) else None
+    return review
 
 
 def improve(draft_text: str,
             essay_text: str,
             essay4thesis_abs: str,
             critique_text: str,
-            improve_prompt: str,
+            improve_prompt: Union[str, PromptTemplate],
             system_prompt: str,
             model: str = 'dsr1',
             *,
             save_raw_path: Optional[str] = None,
             save_json_path: Optional[str] = None,
             save_revised_path: Optional[str] = None,
-            save_failed_path: Optional[str] = None) -> Optional[str]:
+            save_failed_path: Optional[str] = None,
+            usage: Optional[dict] = None) -> Optional[str]:
     """Call LLM as improver, parse JSON, save raw/json/revised and return revised text or None."""
-    prompt_filled = improve_prompt.replace('{原始博士论文草稿}', draft_text)
-    prompt_filled = prompt_filled.replace('{批评意见}', critique_text or '')
-    prompt_filled = prompt_filled.replace('{博士论文前言}', essay4thesis_abs or '')
-    prompt_filled = prompt_filled.replace('{essay内容}', essay_text or '')
+    prompt_filled, _ = fit_prompt(as_template(improve_prompt, 'improve_prompt'), {
+        '原始博士论文草稿': draft_text,
+        '批评意见': critique_text or '',
+        '博士论文前言': essay4thesis_abs or '',
+        'essay内容': essay_text or '',
+    }, model, reducible=('博士论文前言',),
+        system_prompt=system_prompt, stage='improve', variable=('原始博士论文草稿', '批评意见', 'essay内容'))
 
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt_filled},
     ]
 
-    last_exc = None
-    for attempt in range(1, RETRY_COUNT + 1):
-        try:
-            resp = query_llm(messages, model=model)
-            raw = str(resp) if resp is not None else ''
+    try:
+        with telemetry.tag(stage='improve'):
+            cleaned, parsed = _query_and_parse(messages, model, clean=True, expected_keys=('revised_text',), usage=usage,
+                                               save_raw_path=save_raw_path, save_failed_path=save_failed_path)
+    except CassetteMiss:
+        # 回放模式下缺少录制说明请求与录制时不同，直接报错而不是当作一次失败的调用
+        raise
+    except Exception as e:
+        _save_json(save_json_path, {'__parse_error__': str(e), '__error_kind__': classify_error(e)})
+        return None
 
-            if save_raw_path:
-                try:
-                    os.makedirs(os.path.dirname(save_raw_path), exist_ok=True)
-                    with open(save_raw_path, 'w', encoding='utf-8') as f:
-                        f.write(raw)
-                except Exception:
-                    pass
-
-            cleaned = remove_think_chain(raw)
-            parsed = parse_llm_json(cleaned, save_failed_path=save_failed_path)
-
-            if save_json_path:
-                try:
-                    os.makedirs(os.path.dirname(save_json_path), exist_ok=True)
-                    with open(save_json_path, 'w', encoding='utf-8') as f:
-                        json.dump(parsed, f, ensure_ascii=False, indent=2)
-                except Exception:
-                    pass
-
-            revised = None
-            if isinstance(parsed, dict) and 'revised_text' in parsed:
-                revised = parsed.get('revised_text')
-            else:
-                revised = cleaned
+    _save_json(save_json_path, parsed)
 
-            if save_revised_path and revised is not None:
-                try:
-                    os.makedirs(os.path.dirname(save_revised_path), exist_ok=True)
-                    with open(save_revised_path, 'w', encoding='utf-8') as f:
-                        f.write(revised)
-                except Exception:
-                    pass
+    revised = None
+    if isinstance(parsed, dict) and 'revised_text' in parsed:
+        revised = parsed.get('revised_text')
+    else:
+        revised = cleaned
 
-            return revised
-        except Exception as e:
-            last_exc = e
-            if attempt < RETRY_COUNT:
-                time.sleep(RETRY_DELAY)
-                continue
-            if save_json_path:
-                try:
-                    os.makedirs(os.path.dirname(save_json_path), exist_ok=True)
-                    with open(save_json_path, 'w', encoding='utf-8') as f:
-                        json.dump({'__parse_error__': str(last_exc)}, f, ensure_ascii=False, indent=2)
-                except Exception:
-                    pass
-            return None
+    if revised is not None:
+        _save_text(save_revised_path, revised)
+
+    return revised
 
 
 def _next_run_dir(base_dir: str, draft_path: str) -> str:
@@ -181,6 +216,29 @@ def _next_run_dir(base_dir: str, draft_path: str) -> str:
     return run_dir
 
 
+def _change_ratio(before: str, after: str) -> float:
+    """Normalised edit distance between two drafts: 0 for identical text, 1 for completely different."""
+    if before == after:
+        return 0.0
+    return 1.0 - difflib.SequenceMatcher(None, before or '', after or '').ratio()
+
+
+def _critic_severity(parsed: Optional[dict]) -> Tuple[Optional[float], Optional[float]]:
+    """Read the optional numeric severity/score fields from the critic JSON."""
+    values = []
+    for key in ('severity', 'score'):
+        try:
+            values.append(float(parsed.get(key)) if isinstance(parsed, dict) and parsed.get(key) is not None else None)
+        except (TypeError, ValueError):
+            values.append(None)
+    return values[0], values[1]
+
+
+def _critic_pointer_path(draft_path: str) -> str:
+    """Per-draft pointer (<draft>.critic_improve.manifest.json), so drafts in one directory don't overwrite each other's."""
+    return draft_path + '.critic_improve'
+
+
 def iterate_critic_improve(draft_path: str,
                            essay_path: str,
                            essay4thesis_abs_path: str,
@@ -190,9 +248,38 @@ def iterate_critic_improve(draft_path: str,
                            model: str = 'dsr1',
                            critic_prompt_path: str = 'prompts/critic.txt',
                            improve_prompt_path: str = 'prompts/improve.txt',
-                           system_prompt_path: str = 'prompts/sys_prompt1.txt') -> str:
-    critic_prompt = load_prompt(critic_prompt_path)
-    improve_prompt = load_prompt(improve_prompt_path)
+                           system_prompt_path: str = 'prompts/sys_prompt1.txt',
+                           incremental: bool = True,
+                           min_change: Optional[float] = MIN_CHANGE,
+                           stop_severity: Optional[float] = STOP_SEVERITY,
+                           stop_score: Optional[float] = None,
+                           token_budget: Optional[int] = None) -> str:
+    """Run critic/improve rounds on a draft and return the run directory.
+
+    Rounds stop before `rounds` is reached when:
+      - the critic reports severity <= stop_severity (or score >= stop_score), so no improve call is made;
+      - the revised draft differs from the previous one by less than min_change (normalised edit distance);
+      - the estimated tokens spent on this draft reach token_budget, or the next round would exceed it.
+    Pass None to disable a criterion. The reason and per-round history are written to <run_dir>/stop.json.
+
+    With incremental=True, a previous run whose inputs (draft, essay, prompts, examples,
+    rounds, model, stopping policy) are unchanged is reused instead of calling the LLM again.
+    """
+    build_inputs = fingerprint(
+        files={'draft': draft_path, 'essay': essay_path, 'essay4thesis_abs': essay4thesis_abs_path,
+               'draft_prompt': draft_prompt_path, 'draft_example': draft_example_path,
+               'critic_prompt': critic_prompt_path, 'improve_prompt': improve_prompt_path,
+               'system_prompt': system_prompt_path},
+        values={'rounds': rounds, 'model': model,
+                'stop_policy': {'min_change': min_change, 'stop_severity': stop_severity,
+                                'stop_score': stop_score, 'token_budget': token_budget}})
+    pointer = read_manifest(_critic_pointer_path(draft_path))
+    if incremental and pointer and is_fresh(os.path.join(pointer.get('run_dir', ''), 'final_draft.txt'), build_inputs):
+        print(f"输入未变化，跳过 {draft_path} 的批评-修订，复用 {pointer['run_dir']}")
+        return pointer['run_dir']
+
+    critic_prompt = load_template(critic_prompt_path)
+    improve_prompt = load_template(improve_prompt_path)
     draft_prompt = load_prompt(draft_prompt_path)
     system_prompt = load_prompt(system_prompt_path)
 
@@ -203,14 +290,37 @@ def iterate_critic_improve(draft_path: str,
 
     run_dir = _next_run_dir('data/backups/critic_improve', draft_path)
     current = draft_text
+    usage = {'tokens': 0}
+    history = []
+    stop_reason = 'max_rounds'
+    # 至少有一轮得到批评意见或修订稿时才记录 manifest，全部失败时下次增量运行会重试
+    produced = False
 
     for r in range(1, rounds + 1):
+        if token_budget is not None and history:
+            # 按上一轮的消耗预估本轮，预计超出预算时不再开始新一轮
+            if usage['tokens'] + history[-1]['tokens'] > token_budget:
+                stop_reason = 'token_budget'
+                break
+        round_start = usage['tokens']
+
         crit_raw = os.path.join(run_dir, f'critique_round_{r}_raw.txt')
         crit_json = os.path.join(run_dir, f'critique_round_{r}.json')
         crit_review = os.path.join(run_dir, f'critique_round_{r}_review.txt')
         crit_failed = os.path.join(run_dir, f'critique_round_{r}_failed_raw.txt')
 
-        review = critic(current, essay_text, draft_example_text, draft_prompt, critic_prompt, system_prompt, model=model, save_raw_path=crit_raw, save_json_path=crit_json, save_review_path=crit_review, save_failed_path=crit_failed)
+        review, critique = critic(current, essay_text, draft_example_text, draft_prompt, critic_prompt, system_prompt, model=model, save_raw_path=crit_raw, save_json_path=crit_json, save_review_path=crit_review, save_failed_path=crit_failed, usage=usage, return_json=True)
+        severity, score = _critic_severity(critique)
+        artifact_store.add('critic_rounds', run_dir=run_dir, round=r, kind='critic', severity=severity, score=score,
+                           error=None if review is not None else 'no review', text=review)
+        produced = produced or review is not None
+        record = {'round': r, 'severity': severity, 'score': score, 'change': None}
+        history.append(record)
+        if (stop_severity is not None and severity is not None and severity <= stop_severity) or \
+                (stop_score is not None and score is not None and score >= stop_score):
+            record['tokens'] = usage['tokens'] - round_start
+            stop_reason = 'critic_satisfied'
+            break
 
         imp_raw = os.path.join(run_dir, f'draft_round_{r}_after_raw.txt')
         imp_json = os.path.join(run_dir, f'draft_round_{r}_after.json')
@@ -219,21 +329,123 @@ def iterate_critic_improve(draft_path: str,
 
         revised = improve(current, essay_text, essay4thesis_abs_text, review or '', improve_prompt, system_prompt, model=model,
                          save_raw_path=imp_raw, save_json_path=imp_json, save_revised_path=imp_txt,
-                         save_failed_path=imp_failed)
+                         save_failed_path=imp_failed, usage=usage)
+        record['tokens'] = usage['tokens'] - round_start
 
         if revised:
+            produced = True
+            record['change'] = _change_ratio(current, revised)
             current = revised
+        artifact_store.add('critic_rounds', run_dir=run_dir, round=r, kind='improve', change=record['change'],
+                           error=None if revised else 'no revised text', text=revised)
+        if revised and min_change is not None and record['change'] < min_change:
+            stop_reason = 'converged'
+            break
+        if token_budget is not None and usage['tokens'] >= token_budget:
+            stop_reason = 'token_budget'
+            break
+
+    print(f'{draft_path}: 批评-修订在第 {len(history)} 轮停止（{stop_reason}）')
+    # stop.json 与 final_draft.txt 一样始终写入运行目录，不受 artifact_store 的 backup_files 影响
+    artifact_store.save_backup(os.path.join(run_dir, 'stop.json'),
+                               {'stop_reason': stop_reason, 'rounds_completed': len(history), 'max_rounds': rounds,
+                                'estimated_tokens': usage['tokens'], 'history': history}, keep_file=True)
 
     final = os.path.join(run_dir, 'final_draft.txt')
     try:
         with open(final, 'w', encoding='utf-8') as f:
             f.write(current)
+        if produced:
+            write_manifest(final, build_inputs, model=model, stop_reason=stop_reason)
+            # 在草稿旁记录最近一次运行目录，供下次增量运行判断是否需要重建
+            write_manifest(_critic_pointer_path(draft_path), build_inputs, run_dir=run_dir)
     except Exception:
         pass
 
     return run_dir
 
 
+def _find_drafts(chapter: str, draft_name: str) -> List[str]:
+    """chapter 为目录时查找 <chapter>/*/<draft_name>，否则按 glob 模式匹配。"""
+    if os.path.isdir(chapter):
+        pattern = os.path.join(chapter, '*', draft_name)
+    else:
+        pattern = chapter
+    return sorted(glob.glob(pattern))
+
+
+def batch_critic_improve(chapter: str,
+                         essay_dir: str,
+                         essay4thesis_abs_path: str,
+                         draft_prompt_path: str,
+                         draft_example_path: str,
+                         draft_name: str = '最佳.txt',
+                         rounds: int = 3,
+                         model: str = 'dsr1',
+                         workers: int = 4,
+                         summary_path: Optional[str] = None,
+                         critic_prompt_path: str = 'prompts/critic.txt',
+                         improve_prompt_path: str = 'prompts/improve.txt',
+                         system_prompt_path: str = 'prompts/sys_prompt1.txt',
+                         incremental: bool = True,
+                         **stop_options) -> List[dict]:
+    """Run iterate_critic_improve for every draft under a chapter directory (or glob) in one process.
+
+    The essay for <chapter>/<subsection>/<draft_name> is read from <essay_dir>/<subsection>.txt.
+    Drafts are processed with at most `workers` in flight; prompts are loaded once and shared
+    through the load_prompt/load_template caches. A JSON summary with one entry per draft is
+    written to summary_path (default: <chapter>/critic_improve_summary.json).
+    stop_options (min_change, stop_severity, stop_score, token_budget) are passed to iterate_critic_improve.
+    """
+    drafts = _find_drafts(chapter, draft_name)
+    if not drafts:
+        print(f'未找到草稿: {chapter} / {draft_name}')
+        return []
+
+    # 预先加载共享的提示词，之后各线程直接命中缓存
+    for path in (critic_prompt_path, improve_prompt_path):
+        load_template(path)
+    for path in (system_prompt_path, draft_prompt_path, draft_example_path, essay4thesis_abs_path):
+        load_prompt(path)
+
+    def run_one(draft_path: str) -> dict:
+        subsection = os.path.basename(os.path.dirname(draft_path))
+        essay_path = os.path.join(essay_dir, subsection + '.txt')
+        start = time.monotonic()
+        print(f'Processing file: {draft_path}')
+        try:
+            # 与 main.py 的节点名一致：章节为 第三章，小节为 方法/<小节>
+            part_dir = os.path.dirname(os.path.dirname(os.path.abspath(draft_path)))
+            with telemetry.tag(chapter=os.path.basename(os.path.dirname(part_dir)),
+                               section=f'{os.path.basename(part_dir)}/{subsection}'):
+                run_dir = iterate_critic_improve(draft_path, essay_path, essay4thesis_abs_path, draft_prompt_path,
+                                                 draft_example_path, rounds=rounds, model=model,
+                                                 critic_prompt_path=critic_prompt_path,
+                                                 improve_prompt_path=improve_prompt_path,
+                                                 system_prompt_path=system_prompt_path,
+                                                 incremental=incremental, **stop_options)
+            return {'draft': draft_path, 'essay': essay_path, 'status': 'done', 'run_dir': run_dir,
+                    'elapsed': time.monotonic() - start}
+        except Exception as e:
+            return {'draft': draft_path, 'essay': essay_path, 'status': 'failed', 'error': repr(e),
+                    'elapsed': time.monotonic() - start}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(run_one, drafts))
+
+    if summary_path is None:
+        summary_dir = chapter if os.path.isdir(chapter) else os.path.dirname(os.path.dirname(drafts[0]))
+        summary_path = os.path.join(summary_dir, 'critic_improve_summary.json')
+    try:
+        os.makedirs(os.path.dirname(summary_path) or '.', exist_ok=True)
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump({'rounds': rounds, 'model': model, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f'批量批评-修订结果已保存到 {summary_path}')
+    except Exception:
+        pass
+    return results
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
@@ -245,5 +457,24 @@ if __name__ == '__main__':
     parser.add_argument('--essay4thesis_abs', type=str, default='data/thesis/第三章/方法/overview/最佳.txt')
     parser.add_argument('--rounds', type=int, default=10)
     parser.add_argument('--model', type=str, default='dsr1')
+    parser.add_argument('--min_change', type=float, default=MIN_CHANGE, help='相邻两轮改动比例低于该值时停止，负数表示不启用')
+    parser.add_argument('--stop_severity', type=float, default=STOP_SEVERITY, help='批评 severity 不高于该值时停止，负数表示不启用')
+    parser.add_argument('--stop_score', type=float, default=None, help='批评 score 不低于该值时停止')
+    parser.add_argument('--token_budget', type=int, default=None, help='每篇草稿的估计 token 预算')
+
+    # 批量模式：处理章节目录（或 glob）下的所有草稿，替代 process_methods.ps1
+    parser.add_argument('--batch', type=str, default=None, help='章节目录（如 data/thesis/第三章/方法）或草稿 glob')
+    parser.add_argument('--essay_dir', type=str, default='data/essays/essay1/method')
+    parser.add_argument('--draft_name', type=str, default='最佳.txt')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--summary', type=str, default=None)
     args = parser.parse_args()
-    iterate_critic_improve(args.draft, args.essay, args.essay4thesis_abs, args.draft_prompt, args.draft_example, rounds=args.rounds, model=args.model)
+    stop_options = {'min_change': args.min_change if args.min_change >= 0 else None,
+                    'stop_severity': args.stop_severity if args.stop_severity >= 0 else None,
+                    'stop_score': args.stop_score, 'token_budget': args.token_budget}
+    if args.batch:
+        batch_critic_improve(args.batch, args.essay_dir, args.essay4thesis_abs, args.draft_prompt, args.draft_example,
+                             draft_name=args.draft_name, rounds=args.rounds, model=args.model,
+                             workers=args.workers, summary_path=args.summary, **stop_options)
+    else:
+        iterate_critic_improve(args.draft, args.essay, args.essay4thesis_abs, args.draft_prompt, args.draft_example, rounds=args.rounds, model=args.model, **stop_options)
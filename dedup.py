@@ -0,0 +1,65 @@
+import re
+
+import llm_registry
+
+# config.json 中 "dedup" 的默认值：
+#   enabled: 是否在评审前合并近似重复的候选
+#   threshold: 两个候选的 shingle Jaccard 相似度不低于该值时视为近似重复
+#   shingle_size: 每个 shingle 的字符数（中文按字切分，LaTeX 命令也按字符计入）
+DEFAULT_DEDUP_SETTINGS = {
+    "enabled": True,
+    "threshold": 0.85,
+    "shingle_size": 5,
+}
+
+_whitespace = re.compile(r"\s+")
+
+
+def dedup_settings():
+    settings = dict(DEFAULT_DEDUP_SETTINGS)
+    settings.update(llm_registry.get_settings().get("dedup", {}))
+    return settings
+
+
+def shingles(text, size=DEFAULT_DEDUP_SETTINGS["shingle_size"]):
+    """去掉空白后按 size 个字符切分的 shingle 集合；空白与换行的差异不影响结果。"""
+    text = _whitespace.sub("", text or "")
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def cluster_candidates(candidates, threshold=None, shingle_size=None):
+    """
+    将近似重复的候选归为一组。
+
+    候选按顺序依次与已有各组的代表（组内第一个候选）比较，与某个代表的相似度不低于 threshold 时并入该组，
+    否则自成一组。只与代表比较，避免相似度链式传递把差异较大的候选并在一起。
+    候选数只有个位数，直接计算精确的 Jaccard 相似度，不需要 MinHash 近似。
+
+    返回：
+        list: 每组为 {"representative": 下标, "members": [下标, ...], "similarity": {下标: 与代表的相似度}}，
+            下标从 0 开始，按代表的顺序排列。
+    """
+    settings = dedup_settings() if threshold is None or shingle_size is None else {}
+    threshold = settings["threshold"] if threshold is None else threshold
+    shingle_size = settings["shingle_size"] if shingle_size is None else shingle_size
+
+    sets = [shingles(c, shingle_size) for c in candidates]
+    clusters = []
+    for i, s in enumerate(sets):
+        for cluster in clusters:
+            similarity = jaccard(sets[cluster["representative"]], s)
+            if similarity >= threshold:
+                cluster["members"].append(i)
+                cluster["similarity"][i] = round(similarity, 4)
+                break
+        else:
+            clusters.append({"representative": i, "members": [i], "similarity": {}})
+    return clusters
@@ -1,6 +1,9 @@
 from util import *
-from best_of_N import best_of_N_candidates
-import time
+from prompt_template import load_template
+from context_budget import fit_prompt
+from best_of_N import select_best_candidate
+from portfolio import select_models
+from manifest import fingerprint, is_fresh, write_manifest
 import os
 # 加载提示词
 sys_prompt_path = "prompts/sys_prompt1.txt"
@@ -23,13 +26,26 @@ def generate_essay4thesis_method_section(section_title,
                                  essay4thesis_abs_path,
                                  essay_method_section_path,
                                  output_path,
-                                 model="dsr1"):
+                                 model="dsr1",
+                                 stream=False,
+                                 incremental=True):
     """
     为论文撰写前言部分的摘要内容。
     """
+    # 输入（提示词、样例、essay、模型、章节名）未变化时直接复用上次生成的候选
+    build_inputs = fingerprint(
+        files={"sys_prompt": sys_prompt_path, "write_prompt": method_prompt_path,
+               "example_essay4thesis_abs": example_essay4thesis_abs_path, "example_essay4thesis_method": example_essay4thesis_method_path,
+               "example_essay_method": example_essay_method_path, "essay4thesis_abs": essay4thesis_abs_path,
+               "essay_method_section": essay_method_section_path},
+        values={"model": model, "section_title": section_title})
+    if incremental and is_fresh(output_path, build_inputs):
+        print(f"输入未变化，跳过 {output_path}")
+        return load_prompt(output_path)
+
     # 加载提示词
     sys_prompt = load_prompt(sys_prompt_path)
-    write_prompt = load_prompt(method_prompt_path)
+    write_template = load_template(method_prompt_path)
 
     # 加载参考内容
     example_essay4thesis_method_content = load_prompt(example_essay4thesis_method_path)
@@ -39,13 +55,16 @@ def generate_essay4thesis_method_section(section_title,
     essay_method_content = load_prompt(essay_method_section_path)
     essay4thesis_abs_content = load_prompt(essay4thesis_abs_path)
     
-    # 替换 write_prompt 中的占位符
-    write_prompt = write_prompt.replace("{章节名}", section_title)
-    write_prompt = write_prompt.replace("{前言样例}", example_essay4thesis_abs_content)
-    write_prompt = write_prompt.replace("{essay method 样例}", example_essay_method_content)
-    write_prompt = write_prompt.replace("{对应【方法】写作样例}", example_essay4thesis_method_content)
-    write_prompt = write_prompt.replace("{用户essay Method}", essay_method_content)
-    write_prompt = write_prompt.replace("{用户前言}", essay4thesis_abs_content)
+    # 一次性填充 write_prompt 中的占位符
+    write_prompt, _ = fit_prompt(write_template, {
+        "章节名": section_title,
+        "前言样例": example_essay4thesis_abs_content,
+        "essay method 样例": example_essay_method_content,
+        "对应【方法】写作样例": example_essay4thesis_method_content,
+        "用户essay Method": essay_method_content,
+        "用户前言": essay4thesis_abs_content,
+    }, model, reducible=("前言样例", "essay method 样例", "对应【方法】写作样例", "用户前言"),
+        system_prompt=sys_prompt, stage="generation", variable=("用户essay Method",))
 
 
     # 构建消息
@@ -55,14 +74,23 @@ def generate_essay4thesis_method_section(section_title,
     ]
 
     # 调用模型生成内容
-    response = query_llm(messages, model=model)
-    final_response = response
-    if model in ["dsr1","gemini-2.5-pro","qwen3"]:
-        save_to_file(response, output_path+"_带有思维链.txt")
-        final_response = remove_think_chain(response)
-
-    # 保存生成的内容
-    save_to_file(final_response, output_path)
+    if stream:
+        # 流式模式下边接收边写入文件
+        raw_path = output_path+"_带有思维链.txt" if has_think_chain(model) else None
+        final_response, stream_stats = query_llm_stream(messages, model=model, raw_path=raw_path, output_path=output_path)
+        print(f"{model} 首 token 耗时 {stream_stats['ttft'] or 0:.1f}s，总耗时 {stream_stats['elapsed']:.1f}s")
+    else:
+        response = query_llm(messages, model=model)
+        final_response = response
+        if has_think_chain(model):
+            save_to_file(response, output_path+"_带有思维链.txt")
+            final_response = remove_think_chain(response)
+
+        # 保存生成的内容
+        save_to_file(final_response, output_path)
+
+    if final_response:
+        write_manifest(output_path, build_inputs, model=model)
 
     print(f"生成的内容已保存到 {output_path}")
     return final_response
@@ -77,15 +105,24 @@ def generate_best_essay4thesis_method_section(
         essay4thesis_abs_content,
         essay_method_section_path,
         output_dir,
-        comparison_time=5):
+        comparison_time=5,
+        concurrent=True,
+        max_workers=None,
+        stream=False,
+        incremental=True):
 
     """
     从多个论文前言摘要候选项中挑选出最优的一个。
+
+    concurrent 为 True 时同时向所有模型发送请求，max_workers 控制并发线程数；
+    stream 为 True 时以流式方式生成并实时写入候选文件；
+    incremental 为 True 时跳过输入未变化的候选与最佳结果，只重建过期的部分。
     """
-    model_names = ["gemini-2.0-flash", "dsr1", "gpt-4.1", "dsv3", "qwen3", "gemini-2.5-pro"]
-    candidates = []
-    for model_name in model_names:
-        candidate = generate_essay4thesis_method_section(
+    # 按历史评审结果从 candidate_models() 中挑选本小节请求的模型，增量构建时沿用上次的子集，见 portfolio.select_models
+    model_names = select_models(candidate_models(), best_output_path=output_dir + "最佳.txt" if incremental else None)
+
+    def generate(model_name):
+        return generate_essay4thesis_method_section(
             section_title,
             sys_prompt_path,
             method_prompt_path,
@@ -95,28 +132,26 @@ def generate_best_essay4thesis_method_section(
             essay4thesis_abs_content,
             essay_method_section_path,
             output_dir + "候选" + model_name + ".txt",
-            model=model_name
+            model=model_name,
+            stream=stream,
+            incremental=incremental
         )
-        candidates.append(candidate)
-        time.sleep(2)  # 增加延迟，避免请求过于频繁
 
-    # 调用 best_of_N 进行候选内容对比
-    best_candidate = best_of_N_candidates(
+    candidates = [candidate for _, candidate in generate_candidates(generate, model_names, concurrent=concurrent, max_workers=max_workers)]
+
+    # 调用 best_of_N 进行候选内容对比并保存最佳候选内容
+    return select_best_candidate(
         candidates,
         sys_prompt_path,
         method_prompt_path,
         essay_method_section_path,
+        output_dir + "最佳.txt",
         comparison_time=comparison_time,
-        model="dsr1"
+        model="dsr1",
+        incremental=incremental,
+        model_names=model_names
     )
 
-    # 保存最佳候选内容
-    best_output_path = output_dir + "最佳.txt"
-    save_to_file(best_candidate, best_output_path)
-
-    print(f"最佳候选内容已保存到 {best_output_path}")
-    return best_candidate
-
 def generate_essay4thesis_method(
         section_title_param,
         sys_prompt_path_param,
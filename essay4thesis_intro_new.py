@@ -1,6 +1,9 @@
 from util import *
-import time
-from best_of_N import best_of_N_candidates
+from prompt_template import load_template
+from context_budget import fit_prompt
+from best_of_N import select_best_candidate
+from portfolio import select_models
+from manifest import fingerprint, is_fresh, write_manifest
 # 加载提示词
 sys_prompt_path = "prompts/sys_prompt1.txt"
 essay4thesis_intro_prompt_path = "prompts/essay4thesis_引言_prompt.txt"
@@ -13,24 +16,37 @@ model = "dsr1"
 output_dir = "data/thesis/第三章/引言/"
 section_title = "【第三章 面向大模型幻觉的生成不确定性估计方法】"
 
-def generate_essay4thesis_intro(section_title, sys_prompt_path, essay4thesis_intro_prompt_path, example_essay4thesis_intro_path, example_essay_intro_path, essay_intro_path, output_path, model="dsr1"):
+def generate_essay4thesis_intro(section_title, sys_prompt_path, essay4thesis_intro_prompt_path, example_essay4thesis_intro_path, example_essay_intro_path, essay_intro_path, output_path, model="dsr1", stream=False, incremental=True):
     """
     为论文撰写引言部分的摘要内容。
     """
+    # 输入（提示词、样例、essay、模型、章节名）未变化时直接复用上次生成的候选
+    build_inputs = fingerprint(
+        files={"sys_prompt": sys_prompt_path, "write_prompt": essay4thesis_intro_prompt_path,
+               "example_essay4thesis_intro": example_essay4thesis_intro_path, "example_essay_intro": example_essay_intro_path,
+               "essay_intro": essay_intro_path},
+        values={"model": model, "section_title": section_title})
+    if incremental and is_fresh(output_path, build_inputs):
+        print(f"输入未变化，跳过 {output_path}")
+        return load_prompt(output_path)
+
     # 加载提示词
     sys_prompt = load_prompt(sys_prompt_path)
-    write_prompt = load_prompt(essay4thesis_intro_prompt_path)
+    write_template = load_template(essay4thesis_intro_prompt_path)
 
     # 加载参考内容
     example_essay4thesis_intro_content = load_prompt(example_essay4thesis_intro_path)
     example_essay_intro_content = load_prompt(example_essay_intro_path)
     essay_intro_content = load_prompt(essay_intro_path)
     
-    # 替换 write_prompt 中的占位符
-    write_prompt = write_prompt.replace("{章节名}", section_title)
-    write_prompt = write_prompt.replace("{essay intro 样例}", example_essay_intro_content)
-    write_prompt = write_prompt.replace("{对应【引言】写作样例}", example_essay4thesis_intro_content)
-    write_prompt = write_prompt.replace("{用户essay intro}", essay_intro_content)
+    # 一次性填充 write_prompt 中的占位符
+    write_prompt, _ = fit_prompt(write_template, {
+        "章节名": section_title,
+        "essay intro 样例": example_essay_intro_content,
+        "对应【引言】写作样例": example_essay4thesis_intro_content,
+        "用户essay intro": essay_intro_content,
+    }, model, reducible=("essay intro 样例", "对应【引言】写作样例"),
+        system_prompt=sys_prompt, stage="generation", variable=("用户essay intro",))
 
 
     # 构建消息
@@ -40,27 +56,41 @@ def generate_essay4thesis_intro(section_title, sys_prompt_path, essay4thesis_int
     ]
 
     # 调用模型生成内容
-    response = query_llm(messages, model="gemini-2.0-flash")
-    final_response = response
-    if model in ["dsr1","gemini-2.5-pro","qwen3"]:
-        save_to_file(response, output_path+"_带有思维链.txt")
-        final_response = remove_think_chain(response)
-
-    # 保存生成的内容
-    save_to_file(final_response, output_path)
+    if stream:
+        # 流式模式下边接收边写入文件
+        raw_path = output_path+"_带有思维链.txt" if has_think_chain(model) else None
+        final_response, stream_stats = query_llm_stream(messages, model=model, raw_path=raw_path, output_path=output_path)
+        print(f"{model} 首 token 耗时 {stream_stats['ttft'] or 0:.1f}s，总耗时 {stream_stats['elapsed']:.1f}s")
+    else:
+        response = query_llm(messages, model=model)
+        final_response = response
+        if has_think_chain(model):
+            save_to_file(response, output_path+"_带有思维链.txt")
+            final_response = remove_think_chain(response)
+
+        # 保存生成的内容
+        save_to_file(final_response, output_path)
+
+    if final_response:
+        write_manifest(output_path, build_inputs, model=model)
 
     print(f"生成的内容已保存到 {output_path}")
     return final_response
 
-def generate_best_essay4thesis_intro(section_title, sys_prompt_path, essay4thesis_intro_prompt_path, example_essay4thesis_intro_path, example_essay_intro_path, essay_intro_path, output_dir, model="dsr1"):
+def generate_best_essay4thesis_intro(section_title, sys_prompt_path, essay4thesis_intro_prompt_path, example_essay4thesis_intro_path, example_essay_intro_path, essay_intro_path, output_dir, model="dsr1", concurrent=True, max_workers=None, stream=False, incremental=True):
 
     """
     从多个论文前言摘要候选项中挑选出最优的一个。
+
+    concurrent 为 True 时同时向所有模型发送请求，max_workers 控制并发线程数；
+    stream 为 True 时以流式方式生成并实时写入候选文件；
+    incremental 为 True 时跳过输入未变化的候选与最佳结果，只重建过期的部分。
     """
-    model_name_list =  ["gemini-2.0-flash", "dsr1","gpt-4.1", "dsv3", "qwen3","gemini-2.5-pro"]
-    candidate_essay4thesis_intro_list = []
-    for model in model_name_list:
-        candidate_essay4thesis_intro = generate_essay4thesis_intro(
+    # 按历史评审结果从 candidate_models() 中挑选本小节请求的模型，增量构建时沿用上次的子集，见 portfolio.select_models
+    model_name_list = select_models(candidate_models(), best_output_path=output_dir + "最佳.txt" if incremental else None)
+
+    def generate(model):
+        return generate_essay4thesis_intro(
             section_title,
             sys_prompt_path,
             essay4thesis_intro_prompt_path,
@@ -68,29 +98,27 @@ def generate_best_essay4thesis_intro(section_title, sys_prompt_path, essay4thesi
             example_essay_intro_path,
             essay_intro_path,
             output_dir+"候选"+str(model)+".txt",
-            model=model
+            model=model,
+            stream=stream,
+            incremental=incremental
         )
-        candidate_essay4thesis_intro_list.append(candidate_essay4thesis_intro)
-        time.sleep(2)  # 增加延迟，避免请求过于频繁
 
+    candidate_essay4thesis_intro_list = [candidate for _, candidate in generate_candidates(generate, model_name_list, concurrent=concurrent, max_workers=max_workers)]
 
-    # 调用 best_of_N 进行候选内容对比
-    best_candidate = best_of_N_candidates(
+
+    # 调用 best_of_N 进行候选内容对比并保存最佳候选内容
+    return select_best_candidate(
         candidate_essay4thesis_intro_list,
         sys_prompt_path,
         essay4thesis_intro_prompt_path,
         essay_intro_path,
+        output_dir + "最佳.txt",
         comparison_time=5,
-        model="dsr1"
+        model="dsr1",
+        incremental=incremental,
+        model_names=model_name_list
     )
 
-    # 保存最佳候选内容
-    best_output_path = output_dir + "最佳.txt"
-    save_to_file(best_candidate, best_output_path)
-
-    print(f"最佳候选内容已保存到 {best_output_path}")
-    return best_candidate
-
 if __name__ == "__main__":
     for part in ["after_itp"]:
         essay4thesis_intro_prompt_path_temp = essay4thesis_intro_prompt_path.replace(".txt", "_"+part+".txt")
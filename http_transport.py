@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+
+# config.json 中 "http" 的默认值，时间单位为秒
+DEFAULT_HTTP_SETTINGS = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30,
+    "http2": False,
+    "connect_timeout": 10,
+    "read_timeout": 600,
+    "write_timeout": 60,
+    "pool_timeout": 30,
+}
+
+_settings = dict(DEFAULT_HTTP_SETTINGS)
+_sync_client = None
+_sync_transport = None
+_async_transports = weakref.WeakKeyDictionary()
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+class _Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.errors = 0
+
+    def start(self):
+        with self.lock:
+            self.started += 1
+
+    def finish(self, ok):
+        with self.lock:
+            self.completed += 1
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {"requests": self.started, "in_flight": self.started - self.completed, "errors": self.errors}
+
+
+class CountingTransport(httpx.HTTPTransport):
+    """记录请求数的同步连接池，in_flight 为已发出但尚未收到响应头的请求数。"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = _Counters()
+
+    def handle_request(self, request):
+        self.counters.start()
+        ok = False
+        try:
+            response = super().handle_request(request)
+            ok = True
+            return response
+        finally:
+            self.counters.finish(ok)
+
+
+class AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    """CountingTransport 的异步版本。"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = _Counters()
+
+    async def handle_async_request(self, request):
+        self.counters.start()
+        ok = False
+        try:
+            response = await super().handle_async_request(request)
+            ok = True
+            return response
+        finally:
+            self.counters.finish(ok)
+
+
+def configure(http_settings):
+    """
+    根据 config.json 中的 "http" 配置连接池与超时，例如：
+        {"max_connections": 200, "max_keepalive_connections": 50, "http2": true, "read_timeout": 900}
+    已创建的连接池会被关闭，之后按新配置重新创建。
+    """
+    global _settings, _sync_client, _sync_transport
+    with _lock:
+        _settings = dict(DEFAULT_HTTP_SETTINGS)
+        _settings.update(http_settings or {})
+        if _settings["http2"]:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("未安装 h2，HTTP/2 已禁用（pip install httpx[http2]）")
+                _settings["http2"] = False
+        if _sync_client is not None:
+            _sync_client.close()
+        _sync_client = None
+        _sync_transport = None
+        _async_clients.clear()
+        _async_transports.clear()
+
+
+def timeout():
+    """返回按配置构建的 httpx.Timeout，SDK 客户端也应使用同一超时。"""
+    return httpx.Timeout(connect=_settings["connect_timeout"], read=_settings["read_timeout"],
+                         write=_settings["write_timeout"], pool=_settings["pool_timeout"])
+
+
+def _limits():
+    return httpx.Limits(max_connections=_settings["max_connections"],
+                        max_keepalive_connections=_settings["max_keepalive_connections"],
+                        keepalive_expiry=_settings["keepalive_expiry"])
+
+
+def get_http_client():
+    """返回进程内所有服务商共享的同步 httpx.Client（按域名复用 keep-alive 连接）。"""
+    global _sync_client, _sync_transport
+    with _lock:
+        if _sync_client is None:
+            _sync_transport = CountingTransport(limits=_limits(), http2=_settings["http2"])
+            _sync_client = httpx.Client(transport=_sync_transport, timeout=timeout(), follow_redirects=True)
+        return _sync_client
+
+
+def get_async_http_client():
+    """返回当前事件循环共享的 httpx.AsyncClient。"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_clients:
+            transport = AsyncCountingTransport(limits=_limits(), http2=_settings["http2"])
+            _async_transports[loop] = transport
+            _async_clients[loop] = httpx.AsyncClient(transport=transport, timeout=timeout(), follow_redirects=True)
+        return _async_clients[loop]
+
+
+def _connection_stats(transport):
+    stats = {"connections": 0, "idle": 0, "active": 0, "http2": 0}
+    pool = getattr(transport, "_pool", None)
+    for connection in list(getattr(pool, "connections", []) or []):
+        stats["connections"] += 1
+        try:
+            if connection.is_idle():
+                stats["idle"] += 1
+            else:
+                stats["active"] += 1
+            if getattr(connection, "_connection", None).__class__.__name__.startswith("HTTP2"):
+                stats["http2"] += 1
+        except Exception:
+            continue
+    return stats
+
+
+def pool_stats():
+    """
+    返回连接池统计，用于为高并发运行调整连接池大小：
+        sync/async 各自的请求数、在途请求数、错误数、连接数（空闲/活跃/HTTP2），以及当前配置。
+    """
+    with _lock:
+        result = {"settings": dict(_settings), "sync": None, "async": []}
+        if _sync_transport is not None:
+            result["sync"] = {**_sync_transport.counters.snapshot(), **_connection_stats(_sync_transport)}
+        for transport in list(_async_transports.values()):
+            result["async"].append({**transport.counters.snapshot(), **_connection_stats(transport)})
+    return result
@@ -0,0 +1,229 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = "data/cache/llm"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL = 30 * 24 * 3600
+# 累计计数保存在缓存目录根部，记录本身都在 <key 前两位>/ 子目录中
+STATS_FILE = "stats.json"
+
+
+def make_key(model_name, messages, params=None):
+    """根据服务商模型名、消息与采样参数计算缓存键（sha256）。"""
+    payload = json.dumps({"model": model_name, "messages": messages, "params": params or {}},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    以内容哈希为键的磁盘响应缓存。
+
+    每条记录保存为 <cache_dir>/<key 前两位>/<key>.json；命中时更新文件 mtime，
+    总大小超过 max_bytes 时按 mtime 从旧到新淘汰（LRU），超过 ttl 秒的记录视为失效。
+    命中/未命中等计数在进程退出时累加到 <cache_dir>/stats.json，跨运行统计命中率。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+        # 已累加到 stats.json 的计数
+        self.saved = dict.fromkeys(self.counters, 0)
+        atexit.register(self.save_stats)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _stats_path(self):
+        return os.path.join(self.cache_dir, STATS_FILE)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            if root == self.cache_dir:
+                continue
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def get(self, key):
+        """返回缓存的响应内容，未命中或已过期时返回 None。"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+        if self.ttl and time.time() - record.get("created", 0) > self.ttl:
+            self._remove(path)
+            self._count("expired")
+            self._count("misses")
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return record.get("content")
+
+    def set(self, key, content, meta=None):
+        """写入一条记录，必要时触发 LRU 淘汰。"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 覆盖已有记录（如 cache="refresh"）时，旧记录的大小不再计入总量
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        record = {"created": time.time(), "content": content, "meta": meta or {}}
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._count("writes")
+
+        size = os.path.getsize(path)
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(s for _, s, _ in self._entries())
+            else:
+                self.total_bytes += size - old_size
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        if self.total_bytes is not None:
+            self.total_bytes -= size
+
+    def _evict(self):
+        # 调用方已持有锁；淘汰到上限的 90%，避免每次写入都扫描目录
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self.total_bytes = sum(s for _, s, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            for path, _, _ in list(self._entries()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.total_bytes = 0
+            # 清空后重新统计命中率
+            try:
+                os.remove(self._stats_path())
+            except OSError:
+                pass
+            self.counters = dict.fromkeys(self.counters, 0)
+            self.saved = dict.fromkeys(self.counters, 0)
+
+    def _read_totals(self):
+        try:
+            with open(self._stats_path(), "r", encoding="utf-8") as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {}
+        return {k: totals.get(k, 0) for k in self.counters}
+
+    def save_stats(self):
+        """将本进程尚未保存的计数累加到 <cache_dir>/stats.json；进程退出时自动调用。"""
+        with self.lock:
+            delta = {k: v - self.saved[k] for k, v in self.counters.items()}
+            if not any(delta.values()):
+                return
+            totals = self._read_totals()
+            for k, v in delta.items():
+                totals[k] += v
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self._stats_path()}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(totals, f)
+            os.replace(tmp_path, self._stats_path())
+            self.saved = dict(self.counters)
+
+    def stats(self, cumulative=False):
+        """
+        返回命中/未命中等计数，以及当前条目数和占用字节数。
+
+        cumulative 为 False 时只统计本进程（本次运行）；为 True 时加上 stats.json 中以往各次运行的累计计数。
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            if cumulative:
+                totals = self._read_totals()
+                stats = {k: totals[k] + v - self.saved[k] for k, v in stats.items()}
+        entries = list(self._entries())
+        stats["entries"] = len(entries)
+        stats["bytes"] = sum(s for _, s, _ in entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+
+
+def configure(cache_settings):
+    """
+    根据 config.json 中的 "cache" 配置创建全局缓存：
+        {"enabled": true, "dir": "data/cache/llm", "max_bytes": 536870912, "ttl": 2592000}
+    enabled 为 false 时关闭缓存。
+    """
+    global _cache
+    cache_settings = cache_settings or {}
+    if not cache_settings.get("enabled", True):
+        _cache = None
+        return
+    _cache = ResponseCache(cache_settings.get("dir", DEFAULT_CACHE_DIR),
+                           cache_settings.get("max_bytes", DEFAULT_MAX_BYTES),
+                           cache_settings.get("ttl", DEFAULT_TTL))
+
+
+def get_cache():
+    """返回全局缓存，未启用时返回 None。"""
+    return _cache
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["stats", "clear"])
+    parser.add_argument("--dir", type=str, default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+    cache = ResponseCache(args.dir)
+    if args.action == "clear":
+        cache.clear()
+    print(json.dumps(cache.stats(cumulative=True), ensure_ascii=False, indent=2))
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+
+import http_transport
+
+# config.json 的默认位置，可用环境变量 ESSAY4THESIS_CONFIG 指定其他路径
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+# config.json 中没有 "models" 时使用的默认模型表；config 中的同名条目会覆盖这里的字段
+DEFAULT_MODELS = {
+    "doubao": {"provider": "doubao", "model": "ep-20241031214346-9xd5h"},
+    "qwen3": {"provider": "yidong", "model": "qwen3-32b", "think_chain": True},
+    "dsv3": {"provider": "yidong", "model": "deepseek-v3"},
+    "gpt-4.1": {"provider": "openai", "model": "gpt-4.1"},
+    "dsr1": {"provider": "yidong", "model": "deepseek-r1", "think_chain": True},
+    "gemini-2.0-flash": {"provider": "google", "model": "gemini-2.0-flash"},
+    "gemini-2.5-pro": {"provider": "google", "model": "gemini-2.5-pro", "think_chain": True},
+}
+
+# generate_best_* 默认用于生成候选的模型，可在 config.json 的 "candidate_models" 中覆盖
+DEFAULT_CANDIDATE_MODELS = ["gemini-2.0-flash", "dsr1", "gpt-4.1", "dsv3", "qwen3", "gemini-2.5-pro"]
+
+# 服务商使用的 SDK，未列出的服务商使用 OpenAI 兼容接口
+DEFAULT_PROVIDER_SDKS = {"doubao": "ark"}
+
+_settings = None
+_models = None
+_clients = {}
+_lock = threading.RLock()
+
+
+def config_path():
+    return os.environ.get("ESSAY4THESIS_CONFIG", DEFAULT_CONFIG_PATH)
+
+
+def get_settings():
+    """首次调用时读取 config.json，之后返回同一份设置。"""
+    global _settings
+    with _lock:
+        if _settings is None:
+            with open(config_path(), "r", encoding="utf-8") as f:
+                _settings = json.load(f)
+            http_transport.configure(_settings.get("http", {}))
+        return _settings
+
+
+def reset(settings=None):
+    """丢弃已加载的设置与客户端；传入 settings 时直接使用该设置而不读取文件。"""
+    global _settings, _models
+    with _lock:
+        _settings = settings
+        _models = None
+        _clients.clear()
+        if settings is not None:
+            http_transport.configure(settings.get("http", {}))
+
+
+def models():
+    """返回 别名 -> 模型配置 的字典（默认模型表与 config.json 中 "models" 合并后的结果）。"""
+    global _models
+    with _lock:
+        if _models is None:
+            merged = {alias: dict(spec) for alias, spec in DEFAULT_MODELS.items()}
+            for alias, spec in get_settings().get("models", {}).items():
+                merged.setdefault(alias, {}).update(spec)
+            _models = merged
+        return _models
+
+
+def model_spec(alias):
+    spec = models().get(alias)
+    if spec is None:
+        raise KeyError(f"未知模型: {alias}，请在 config.json 的 \"models\" 中配置")
+    return spec
+
+
+def model_aliases():
+    return list(models())
+
+
+def candidate_models():
+    """生成候选内容时使用的模型别名列表。"""
+    return list(get_settings().get("candidate_models", DEFAULT_CANDIDATE_MODELS))
+
+
+def model_name(alias):
+    """别名对应的服务商模型名（或豆包的 endpoint ID）。"""
+    return model_spec(alias)["model"]
+
+
+def provider_of(alias):
+    return model_spec(alias)["provider"]
+
+
+def has_think_chain(alias):
+    """模型输出中是否带有 <think> 思维链。"""
+    return bool(model_spec(alias).get("think_chain", False))
+
+
+def provider_settings(provider):
+    """
+    服务商的连接配置：api_key、base_url 与 sdk（"openai" 或 "ark"）。
+
+    兼容原有的 "api_keys"/"base_urls" 写法，也可以在 "providers" 中按服务商配置。
+    """
+    settings = get_settings()
+    spec = dict(settings.get("providers", {}).get(provider, {}))
+    spec.setdefault("api_key", settings.get("api_keys", {}).get(provider))
+    spec.setdefault("base_url", settings.get("base_urls", {}).get(provider))
+    spec.setdefault("sdk", DEFAULT_PROVIDER_SDKS.get(provider, "openai"))
+    return spec
+
+
+def new_client(provider, asynchronous=False):
+    """
+    创建服务商的 SDK 客户端，SDK 在此时才被导入。
+
+    所有客户端共用 http_transport 中的连接池（异步客户端共用当前事件循环的连接池）与超时设置。
+    """
+    spec = provider_settings(provider)
+    if spec["sdk"] == "ark":
+        from volcenginesdkarkruntime import Ark, AsyncArk
+        client_cls = AsyncArk if asynchronous else Ark
+    else:
+        from openai import OpenAI, AsyncOpenAI
+        client_cls = AsyncOpenAI if asynchronous else OpenAI
+    http_client = http_transport.get_async_http_client() if asynchronous else http_transport.get_http_client()
+    return client_cls(api_key=spec["api_key"], base_url=spec["base_url"],
+                      http_client=http_client, timeout=http_transport.timeout())
+
+
+def get_client(alias):
+    """返回模型别名对应的同步客户端，同一服务商的模型共用一个客户端，首次使用时创建。"""
+    provider = provider_of(alias)
+    with _lock:
+        if provider not in _clients:
+            _clients[provider] = new_client(provider)
+        return _clients[provider]
@@ -1,23 +1,134 @@
-from util import *
-from essay4thesis_abs import *
-from essay4thesis_intro import *
-from best_of_N import best_of_N_candidates
-# 加载提示词
-sys_prompt_path = "prompts/sys_prompt1.txt"
-essay4thesis_abs_prompt_path = "prompts/essay4thesis_前言_prompt.txt"
-essay4thesis_intro_prompt_path = "prompts/essay4thesis_引言_prompt.txt"
-essay4thesis_method_prompt_path = "prompts/essay4thesis_方法_prompt.txt"
-
-# 加载额外内容
-example_essay4thesis_abs_path = "data/thesis/example_essay4thesis_前言.txt"
-example_essay4thesis_intro_path = "data/thesis/example_essay4thesis_引言.txt"
-example_essay4thesis_method_path = "data/thesis/example_essay4thesis_方法.txt"
-
-example_essay_intro_path = "data/essays/example_essay_intro.txt"
-essay_intro_path = "data/essays/essay1/intro.txt"
-
-output_dir = "data/thesis/第三章/方法/"
-section_title = "【第三章 面向大模型幻觉的生成不确定性估计方法】"
+import os
+import json
+import argparse
+from functools import partial
+from scheduler import Task, run_dag, summarize
+import essay4thesis_abs as abs_section
+import essay4thesis_intro as intro_section
+import essay4thesis_method as method_section
+import essay4thesis_exp as exp_section
+from critic_and_improve import iterate_critic_improve
+import telemetry
+from util import cache_stats
+
+chapter_dir = "data/thesis/第三章"
+essay4thesis_abs_path = "data/thesis/第三章/前言/最佳.txt"
+
+
+def build_chapter_tasks(parts=("前言", "引言", "方法", "实验"), critic_rounds=3, critic_model="dsr1", incremental=True):
+    """
+    构建整章写作的依赖图：
+
+        前言 ──┬─> 方法/<小节> ──> 方法/<小节>/critic
+               └─> 实验/<小节> ──> 实验/<小节>/critic
+        引言（不依赖前言，可与前言并行）
+
+    方法、实验的每个小节都依赖 第三章/前言/最佳.txt；critic_rounds 为 0 时不进行批评-修订。
+    incremental 为 True 时各节点只重建输入指纹发生变化的产物（见 manifest.py）。
+    """
+    tasks = []
+    abs_deps = []
+    if "前言" in parts:
+        tasks.append(Task("前言", partial(
+            abs_section.generate_best_essay4thesis_abs,
+            abs_section.section_title,
+            abs_section.sys_prompt_path,
+            abs_section.essay4thesis_abs_prompt_path,
+            abs_section.example_essay4thesis_abs_path,
+            abs_section.example_essay_intro_path,
+            abs_section.essay_intro_path,
+            incremental=incremental)))
+        abs_deps = ["前言"]
+
+    if "引言" in parts:
+        tasks.append(Task("引言", partial(
+            intro_section.generate_best_essay4thesis_intro,
+            intro_section.section_title,
+            intro_section.sys_prompt_path,
+            intro_section.essay4thesis_intro_prompt_path,
+            intro_section.example_essay4thesis_intro_path,
+            intro_section.example_essay_intro_path,
+            intro_section.essay_intro_path,
+            incremental=incremental)))
+
+    # 方法与实验的各小节共用同一套生成函数，只是输入目录、样例与输出目录不同；
+    # 节点名称取自模块实际配置的输出目录（如 第三章/实验/），避免与脚本文件名不一致
+    for module in (method_section, exp_section):
+        part = os.path.basename(os.path.normpath(module.output_dir))
+        draft_example_path = module.example_essay4thesis_method_path
+        if part not in parts or not os.path.isdir(module.essay_method_dir):
+            continue
+        for section_file_name in sorted(os.listdir(module.essay_method_dir)):
+            subsection = os.path.splitext(section_file_name)[0]
+            essay_section_path = os.path.join(module.essay_method_dir, section_file_name)
+            section_output_dir = os.path.join(module.output_dir, subsection) + "/"
+            node = f"{part}/{subsection}"
+            tasks.append(Task(node, partial(
+                module.generate_best_essay4thesis_method_section,
+                module.section_title,
+                module.sys_prompt_path,
+                module.method_prompt_path,
+                module.example_essay4thesis_abs_path,
+                module.example_essay4thesis_method_path,
+                module.example_essay_method_path,
+                module.essay4thesis_abs_path,
+                essay_section_path,
+                section_output_dir,
+                incremental=incremental), deps=abs_deps))
+
+            if critic_rounds > 0:
+                tasks.append(Task(f"{node}/critic", partial(
+                    iterate_critic_improve,
+                    section_output_dir + "最佳.txt",
+                    essay_section_path,
+                    essay4thesis_abs_path,
+                    module.method_prompt_path,
+                    draft_example_path,
+                    rounds=critic_rounds,
+                    model=critic_model,
+                    incremental=incremental), deps=[node]))
+    return _tag_tasks(tasks)
+
+
+def _tag_tasks(tasks):
+    """为每个节点的 LLM 调用加上章节与小节标签（critic 节点与其小节同名），用于 telemetry 按章节汇总。"""
+    chapter = os.path.basename(chapter_dir)
+
+    def tagged(fn, section):
+        def run():
+            with telemetry.tag(chapter=chapter, section=section):
+                return fn()
+        return run
+
+    for task in tasks:
+        section = task.name[:-len("/critic")] if task.name.endswith("/critic") else task.name
+        task.fn = tagged(task.fn, section)
+    return tasks
+
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parts', type=str, nargs='+', default=["前言", "引言", "方法", "实验"])
+    parser.add_argument('--workers', type=int, default=4, help='同时执行的节点数上限')
+    parser.add_argument('--critic_rounds', type=int, default=3)
+    parser.add_argument('--critic_model', type=str, default='dsr1')
+    parser.add_argument('--rebuild', action='store_true', help='忽略已有产物，全部重新生成')
+    args = parser.parse_args()
+
+    tasks = build_chapter_tasks(args.parts, critic_rounds=args.critic_rounds, critic_model=args.critic_model,
+                                incremental=not args.rebuild)
+    report = run_dag(tasks, max_workers=args.workers)
+    summary = summarize(tasks, report)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    llm_usage = telemetry.run_report()
+    print(json.dumps(llm_usage["by_model_stage"], ensure_ascii=False, indent=2))
+    # 本次运行的响应缓存命中情况；缓存未启用时为 None
+    cache_usage = cache_stats()
+    if cache_usage is not None:
+        print(f"响应缓存：命中 {cache_usage['hits']} 次，未命中 {cache_usage['misses']} 次，命中率 {cache_usage['hit_rate']:.1%}")
+
+    os.makedirs(chapter_dir, exist_ok=True)
+    with open(os.path.join(chapter_dir, "build_report.json"), "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "llm_usage": llm_usage, "cache": cache_usage,
+                   "tasks": {name: {k: v for k, v in r.items() if k != "result"} for name, r in report.items()}},
+                  f, ensure_ascii=False, indent=2)
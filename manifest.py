@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import threading
+
+# 路径 -> (mtime_ns, 文件大小, sha256)，文件未修改时不重复计算哈希
+_file_hashes = {}
+_lock = threading.Lock()
+
+
+def hash_text(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def hash_file(path):
+    """文件内容的 sha256，文件不存在时返回 None。"""
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _file_hashes.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    with _lock:
+        _file_hashes[path] = (st.st_mtime_ns, st.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def fingerprint(files=None, values=None):
+    """
+    计算产物的输入指纹。
+
+    参数：
+        files (dict): 输入名称 -> 文件路径，记录文件内容的哈希（与路径无关）。
+        values (dict): 输入名称 -> 字符串或可 JSON 序列化的值（模型名、章节名、候选内容等）。
+
+    返回：
+        dict: 输入名称 -> 哈希。
+    """
+    inputs = {}
+    for name, path in (files or {}).items():
+        inputs[f"file:{name}"] = hash_file(path)
+    for name, value in (values or {}).items():
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        inputs[f"value:{name}"] = hash_text(value)
+    return inputs
+
+
+def manifest_path(artifact_path):
+    return artifact_path + ".manifest.json"
+
+
+def read_manifest(artifact_path):
+    try:
+        with open(manifest_path(artifact_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(artifact_path, inputs, **extra):
+    """在产物旁写入 <产物>.manifest.json，记录输入指纹与产物自身的哈希。"""
+    record = {"inputs": inputs, "output": hash_file(artifact_path)}
+    record.update(extra)
+    path = manifest_path(artifact_path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+
+
+def is_fresh(artifact_path, inputs):
+    """
+    产物存在、未被手动修改，且输入指纹与上次构建完全一致时返回 True。
+
+    下游产物的输入中包含上游产物的内容哈希，因此上游重建并产生不同内容后，下游会自动失效。
+    """
+    record = read_manifest(artifact_path)
+    if not record or record.get("inputs") != inputs:
+        return False
+    output = hash_file(artifact_path)
+    return output is not None and output == record.get("output")
@@ -0,0 +1,173 @@
+import hashlib
+import random
+import time
+
+import artifact_store
+import llm_registry
+import telemetry
+from manifest import hash_file, read_manifest
+
+# config.json 中 "portfolio" 的默认值：
+#   enabled: 是否按历史评审结果挑选生成候选的模型
+#   max_models: 每个小节最多请求的模型数
+#   max_cost: 每个小节生成候选的预计费用上限（按 telemetry 的 prices 估算），为 null 时只限制模型数
+#   max_latency: 平均生成耗时（秒）超过该值的模型不入选（胜率最高的模型除外），各模型并发生成时决定小节的等待时间
+#   min_comparisons: 某类小节的评审次数少于该值时仍请求全部模型，先积累数据
+#   exploration: 额外加入一个未入选模型的概率，避免长期不用的模型失去被重新评估的机会
+#   window_days: 只使用最近若干天的记录
+DEFAULT_PORTFOLIO_SETTINGS = {
+    "enabled": True,
+    "max_models": 3,
+    "max_cost": None,
+    "max_latency": None,
+    "min_comparisons": 5,
+    "exploration": 0.1,
+    "window_days": 60,
+}
+
+
+def portfolio_settings():
+    settings = dict(DEFAULT_PORTFOLIO_SETTINGS)
+    settings.update(llm_registry.get_settings().get("portfolio", {}))
+    return settings
+
+
+def section_type(section):
+    """小节的类别：方法/3.2 -> 方法，前言 -> 前言。"""
+    return (section or "").split("/")[0] or None
+
+
+def model_stats(kind, since=None, exclude_run=None):
+    """
+    从 artifact_store 统计某类小节中各模型的评审与生成记录；exclude_run 给出时不计入该次运行的记录。
+
+    返回：
+        tuple: (评审次数, {模型: {"trials", "wins", "latency", "prompt_tokens", "completion_tokens", "cost"}})，
+            trials 为该模型的候选参加评审的次数，wins 为胜出次数，latency 与 token 数为单次生成的平均值。
+    """
+    store = artifact_store.get_store()
+    if store is None or not kind:
+        return 0, {}
+    since = since or 0
+    rows = store.query("SELECT COUNT(*) AS n FROM comparisons "
+                       "WHERE (section = ? OR section LIKE ?) AND ts >= ? AND run_id IS NOT ?",
+                       (kind, f"{kind}/%", since, exclude_run))
+    # 数据库尚未创建时没有任何记录
+    comparisons = rows[0]["n"] if rows else 0
+    # 候选与评审在同一次运行、同一小节中产生；胜出的候选按内容哈希识别
+    rows = store.query(
+        "SELECT c.model AS model, COUNT(*) AS trials, SUM(c.sha256 = cmp.winner_sha256) AS wins "
+        "FROM comparisons cmp JOIN candidates c ON c.run_id = cmp.run_id AND c.section IS cmp.section "
+        "WHERE (cmp.section = ? OR cmp.section LIKE ?) AND cmp.ts >= ? AND cmp.run_id IS NOT ? GROUP BY c.model",
+        (kind, f"{kind}/%", since, exclude_run))
+    stats = {r["model"]: {"trials": r["trials"], "wins": r["wins"] or 0} for r in rows}
+    rows = store.query(
+        "SELECT model, AVG(latency) AS latency, AVG(prompt_tokens) AS prompt_tokens, "
+        "AVG(completion_tokens) AS completion_tokens FROM requests "
+        "WHERE stage = 'generation' AND error IS NULL AND NOT cached AND (section = ? OR section LIKE ?) AND ts >= ? "
+        "AND run_id IS NOT ? GROUP BY model", (kind, f"{kind}/%", since, exclude_run))
+    prices = llm_registry.get_settings().get("telemetry", {}).get("prices", {})
+    for r in rows:
+        entry = stats.setdefault(r["model"], {"trials": 0, "wins": 0})
+        price = prices.get(r["model"], {})
+        entry.update({"latency": r["latency"], "prompt_tokens": r["prompt_tokens"],
+                      "completion_tokens": r["completion_tokens"],
+                      "cost": ((r["prompt_tokens"] or 0) * price.get("input", 0)
+                               + (r["completion_tokens"] or 0) * price.get("output", 0)) / 1e6})
+    return comparisons, stats
+
+
+def recorded_models(best_output_path, models):
+    """
+    上次为该小节请求的模型子集（由 select_best_candidate 记录在最佳结果的 manifest 中）。
+
+    最佳结果不存在、已被手动修改、未记录模型，或记录的模型已不在 models 中时返回 None。
+    """
+    record = read_manifest(best_output_path)
+    if not record or not record.get("models"):
+        return None
+    if hash_file(best_output_path) != record.get("output"):
+        return None
+    if any(m not in models for m in record["models"]):
+        return None
+    return [m for m in models if m in record["models"]]
+
+
+def select_models(models, section=None, settings=None, best_output_path=None):
+    """
+    按历史胜率为某个小节挑选生成候选的模型子集（Thompson 采样的多臂老虎机）。
+
+    每个模型的胜率服从 Beta(1 + 胜出次数, 1 + 落选次数)，按采样值从高到低加入，直到达到 max_models
+    或预计费用超过 max_cost，平均耗时超过 max_latency 的模型跳过；历史平均胜率最高的模型总会入选，并以 exploration 的概率额外加入一个未入选的模型。
+    评审记录较少的模型采样值波动大，会被自然地不时选中。随机数以小节类别与此前各次运行的评审次数为种子，
+    不计入本次运行的记录，同一次运行中各小节的评审不会改变后续小节的挑选。
+
+    参数：
+        models (list): 候选模型别名（通常为 candidate_models()）。
+        section (str): 小节名称，默认取 telemetry 标签中的 section。
+        best_output_path (str): 本小节最佳结果的路径（增量构建时给出）。其 manifest 记录了上次请求的模型时沿用该子集，
+            候选与最佳结果的输入指纹保持不变，不会因重新挑选而重新生成与评审。
+
+    返回：
+        list: 按 models 原顺序排列的模型子集；数据不足或未启用时返回全部模型。
+    """
+    settings = settings or portfolio_settings()
+    kind = section_type(section if section is not None else telemetry.current_tags().get("section"))
+    if not settings["enabled"] or not kind or len(models) <= 1:
+        return list(models)
+    if best_output_path:
+        previous = recorded_models(best_output_path, models)
+        if previous:
+            return previous
+    since = time.time() - settings["window_days"] * 86400 if settings.get("window_days") else None
+    comparisons, stats = model_stats(kind, since, exclude_run=telemetry.RUN_ID)
+    if comparisons < settings["min_comparisons"]:
+        return list(models)
+
+    seed = int(hashlib.sha256(f"{kind}:{comparisons}".encode("utf-8")).hexdigest()[:16], 16)
+    rng = random.Random(seed)
+    arms = {}
+    for m in models:
+        s = stats.get(m, {})
+        wins, trials = s.get("wins", 0), s.get("trials", 0)
+        arms[m] = {"sample": rng.betavariate(1 + wins, 1 + trials - wins),
+                   "mean": (1 + wins) / (2 + trials), "cost": s.get("cost") or 0.0, "latency": s.get("latency") or 0.0}
+
+    incumbent = max(models, key=lambda m: arms[m]["mean"])
+    chosen, spent = [incumbent], arms[incumbent]["cost"]
+    for m in sorted(models, key=lambda m: arms[m]["sample"], reverse=True):
+        if len(chosen) >= settings["max_models"]:
+            break
+        if m in chosen:
+            continue
+        if settings.get("max_cost") is not None and spent + arms[m]["cost"] > settings["max_cost"]:
+            continue
+        if settings.get("max_latency") is not None and arms[m]["latency"] > settings["max_latency"]:
+            continue
+        chosen.append(m)
+        spent += arms[m]["cost"]
+    rest = [m for m in models if m not in chosen]
+    if rest and rng.random() < settings["exploration"]:
+        chosen.append(rng.choice(rest))
+
+    skipped = ", ".join(f"{m} {stats.get(m, {}).get('wins', 0)}/{stats.get(m, {}).get('trials', 0)}"
+                        for m in models if m not in chosen)
+    print(f"[portfolio] {kind}: 请求 {', '.join(m for m in models if m in chosen)}"
+          + (f"（跳过 {skipped}，胜出/评审次数）" if skipped else ""))
+    return [m for m in models if m in chosen]
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    parser = argparse.ArgumentParser()
+    parser.add_argument("kind", type=str, nargs="+", help="小节类别，如 方法 实验 前言")
+    args = parser.parse_args()
+    settings = portfolio_settings()
+    since = time.time() - settings["window_days"] * 86400 if settings.get("window_days") else None
+    report = {}
+    for kind in args.kind:
+        comparisons, stats = model_stats(kind, since)
+        report[kind] = {"comparisons": comparisons, "models": stats,
+                        "selected": select_models(llm_registry.candidate_models(), kind, settings)}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
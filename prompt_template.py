@@ -0,0 +1,98 @@
+import os
+import re
+import threading
+
+import llm_registry
+from util import load_prompt
+
+# {占位符}：不跨行、不嵌套；紧跟在英文字母、反斜杠、^ 或 _ 之后的花括号视为 LaTeX（如 \cite{x}、x_{i}），不作为占位符
+PLACEHOLDER_PATTERN = re.compile(r"(?<![A-Za-z\\^_])\{([^{}\n]+)\}")
+
+
+# 提示词布局：inline 按模板原样替换；prefix_cache 将逐次变化的内容移到提示词末尾，
+# 使同一章节的多次请求共享尽可能长的相同前缀，以命中服务商的前缀缓存（DeepSeek、豆包、OpenAI）
+LAYOUTS = ("inline", "prefix_cache")
+
+
+def prompt_layout():
+    """config.json 中的 "prompt_layout"，默认为 "inline"。"""
+    layout = llm_registry.get_settings().get("prompt_layout", "inline")
+    if layout not in LAYOUTS:
+        raise ValueError(f"prompt_layout 必须是 {LAYOUTS} 之一")
+    return layout
+
+
+class TemplateError(ValueError):
+    """模板中的占位符没有对应内容时抛出。"""
+
+
+class PromptTemplate:
+    """
+    预解析的提示词模板。
+
+    构造时将模板切分为文本片段与占位符，render 时一次拼接完成所有替换；
+    填入的内容不会被再次扫描，因此内容中出现的花括号不会被误替换。
+    """
+
+    def __init__(self, text, name="<string>"):
+        self.text = text
+        self.name = name
+        self.parts = []
+        pos = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            self.parts.append((False, text[pos:match.start()]))
+            self.parts.append((True, match.group(1)))
+            pos = match.end()
+        self.parts.append((False, text[pos:]))
+        self.placeholders = frozenset(value for is_field, value in self.parts if is_field)
+
+    def render(self, fields, variable=(), layout=None):
+        """
+        用 fields 中的内容替换全部占位符。
+
+        参数：
+            fields (dict): 占位符名称 -> 内容；模板中的每个占位符都必须提供，模板中没有的字段会被忽略。
+            variable (tuple): 每次请求都会变化的字段（如小节 essay、草稿），只在 prefix_cache 布局下使用。
+            layout (str): "inline" 或 "prefix_cache"，为 None 时使用 config.json 中的 "prompt_layout"。
+                prefix_cache 布局下 variable 中的占位符替换为指向文末的引用，其内容按 variable 的顺序附在提示词末尾，
+                模板正文与不变的字段（样例、前言等）构成稳定的前缀。
+
+        返回：
+            str: 渲染后的提示词。
+        """
+        missing = self.placeholders - fields.keys()
+        if missing:
+            raise TemplateError(f"渲染模板 {self.name} 失败: 缺少占位符 {sorted(missing)}")
+        variable = [name for name in variable if name in self.placeholders]
+        if not variable or (layout or prompt_layout()) == "inline":
+            return "".join(str(fields[value]) if is_field else value for is_field, value in self.parts)
+
+        head = "".join(
+            (f"（见文末「{value}」）" if value in variable else str(fields[value])) if is_field else value
+            for is_field, value in self.parts)
+        tail = "".join(f"\n\n## {name}\n{fields[name]}" for name in variable)
+        return f"{head}\n\n---\n以下为上文引用的内容：{tail}"
+
+
+# 路径 -> (文件内容, 模板)，文件内容来自 load_prompt 的缓存，内容不变时复用已解析的模板
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_template(file_path):
+    """加载并解析提示词模板文件，同一文件只解析一次（文件修改后重新解析）。"""
+    path = os.path.abspath(file_path)
+    text = load_prompt(path)
+    with _templates_lock:
+        cached = _templates.get(path)
+        if cached is None or cached[0] is not text:
+            cached = (text, PromptTemplate(text, file_path))
+            _templates[path] = cached
+    return cached[1]
+
+
+def as_template(template, name="<string>"):
+    """接受 PromptTemplate 或模板字符串，统一返回 PromptTemplate。"""
+    if isinstance(template, PromptTemplate):
+        return template
+    return PromptTemplate(template, name)
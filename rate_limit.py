@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+# 未在 config.json 的 "rate_limits" 中配置的服务商不限速
+_limiters = {}
+_limits = {}
+_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """
+    粗略估计文本的 token 数：中日韩字符按 1 个 token 计，其余字符按 4 个字符 1 个 token 计。
+
+    参数：
+        text (str or list): 文本，或 [{"role":..., "content":...}] 形式的消息列表。
+
+    返回：
+        int: 估计的 token 数。
+    """
+    if isinstance(text, list):
+        text = "".join(str(m.get("content") or "") for m in text)
+    text = text or ""
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "豈" <= ch <= "￯")
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class TokenBucket:
+    """按分钟预算匀速补充的令牌桶，允许透支，透支部分以等待时间偿还。"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.fill_rate = float(per_minute) / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """预留 amount 个令牌，返回需要等待的秒数。"""
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.fill_rate)
+
+    def adjust(self, amount, now):
+        """按实际用量修正预留量，amount 为正表示多用了令牌。"""
+        self._refill(now)
+        self.tokens -= amount
+
+
+class ProviderRateLimiter:
+    """
+    单个服务商的限速器，同时约束每分钟请求数（rpm）与每分钟 token 数（tpm）。
+
+    收到 429 时调用 pause() 暂停该服务商的所有请求。
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens):
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.rpm:
+                wait = max(wait, self.rpm.reserve(1, now))
+            if self.tpm:
+                wait = max(wait, self.tpm.reserve(tokens, now))
+            return wait
+
+    def acquire(self, tokens=0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def adjust(self, tokens):
+        if self.tpm and tokens:
+            with self.lock:
+                self.tpm.adjust(tokens, time.monotonic())
+
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def configure(rate_limits):
+    """
+    设置各服务商的限速配置，格式同 config.json 中的 "rate_limits"：
+        {"yidong": {"rpm": 60, "tpm": 200000}, ...}
+    """
+    global _limits
+    with _lock:
+        _limits = dict(rate_limits or {})
+        _limiters.clear()
+
+
+def get_rate_limiter(provider):
+    """返回服务商共享的限速器，同一进程内的所有调用方共用。"""
+    with _lock:
+        if provider not in _limiters:
+            limit = _limits.get(provider, {})
+            _limiters[provider] = ProviderRateLimiter(limit.get("rpm"), limit.get("tpm"))
+        return _limiters[provider]
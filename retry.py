@@ -0,0 +1,69 @@
+import email.utils
+import json
+import random
+import time
+
+import httpx
+
+# 错误类别：限速、网络抖动、服务端错误可以退避后重试；解析错误先尝试本地修复；其余错误（如 400/401）直接放弃
+RATE_LIMIT = "rate_limit"
+NETWORK = "network"
+SERVER = "server"
+PARSE = "parse"
+FATAL = "fatal"
+
+RETRYABLE = (RATE_LIMIT, NETWORK, SERVER)
+
+# openai / volcengine SDK 中表示连接失败或超时的异常类名，按类名判断以免导入 SDK
+_NETWORK_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "ArkAPIConnectionError", "ArkAPITimeoutError"}
+
+
+def classify_error(e):
+    """
+    将调用或解析 LLM 响应时的异常归类为 RATE_LIMIT / NETWORK / SERVER / PARSE / FATAL 之一。
+    """
+    status = getattr(e, "status_code", None)
+    if status is None and getattr(e, "response", None) is not None:
+        status = getattr(e.response, "status_code", None)
+    if status == 429:
+        return RATE_LIMIT
+    if status == 408:
+        return NETWORK
+    if isinstance(status, int) and status >= 500:
+        return SERVER
+    if isinstance(status, int) and status >= 400:
+        return FATAL
+    if isinstance(e, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return NETWORK
+    if any(cls.__name__ in _NETWORK_ERROR_NAMES for cls in type(e).__mro__):
+        return NETWORK
+    if isinstance(e, (ValueError, json.JSONDecodeError)):
+        return PARSE
+    return FATAL
+
+
+def retry_after(e):
+    """读取异常响应中的 Retry-After（秒数或 HTTP 日期），没有时返回 None。"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=2.0, cap=60.0, e=None):
+    """
+    第 attempt 次（从 1 开始）失败后的等待秒数：full jitter 指数退避，即在 [0, min(cap, base * 2^(attempt-1))] 中随机取值；
+    若异常带有 Retry-After，则至少等待该时长。
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    hinted = retry_after(e) if e is not None else None
+    return max(delay, hinted) if hinted is not None else delay
@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Task:
+    """
+    DAG 中的一个节点。
+
+    参数：
+        name (str): 节点名称，在同一个 DAG 中唯一。
+        fn (callable): 无参数的执行函数。
+        deps (list): 依赖的节点名称，全部成功后才会执行本节点。
+    """
+
+    def __init__(self, name, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+
+    def __repr__(self):
+        return f"Task({self.name!r}, deps={self.deps!r})"
+
+
+def _check_dag(tasks):
+    names = set()
+    for task in tasks:
+        if task.name in names:
+            raise ValueError(f"节点名称重复: {task.name}")
+        names.add(task.name)
+    for task in tasks:
+        for dep in task.deps:
+            if dep not in names:
+                raise ValueError(f"{task.name} 依赖不存在的节点 {dep}")
+
+    # 拓扑排序检查环
+    indegree = {task.name: len(task.deps) for task in tasks}
+    dependents = {task.name: [] for task in tasks}
+    for task in tasks:
+        for dep in task.deps:
+            dependents[dep].append(task.name)
+    ready = [name for name, d in indegree.items() if d == 0]
+    visited = 0
+    while ready:
+        name = ready.pop()
+        visited += 1
+        for child in dependents[name]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    if visited != len(tasks):
+        raise ValueError("任务依赖中存在环")
+    return dependents
+
+
+def run_dag(tasks, max_workers=4):
+    """
+    按依赖关系执行任务：依赖全部完成的节点立即提交，互不依赖的节点在 max_workers 个线程内并发执行。
+
+    某个节点失败时，依赖它的节点会被跳过，其余节点继续执行。
+
+    返回：
+        dict: 节点名称 -> {"status": "done"|"failed"|"skipped", "result", "error", "start", "end"}，
+              时间为相对于开始执行的秒数。
+    """
+    dependents = _check_dag(tasks)
+    by_name = {task.name: task for task in tasks}
+    remaining = {task.name: set(task.deps) for task in tasks}
+    report = {}
+    lock = threading.Lock()
+    t0 = time.monotonic()
+
+    def execute(task):
+        start = time.monotonic() - t0
+        print(f"[scheduler] 开始 {task.name}")
+        try:
+            result = task.fn()
+            status, error = "done", None
+        except Exception as e:
+            result, status, error = None, "failed", repr(e)
+            print(f"[scheduler] {task.name} 失败: {error}")
+        end = time.monotonic() - t0
+        with lock:
+            report[task.name] = {"status": status, "result": result, "error": error, "start": start, "end": end}
+        print(f"[scheduler] 结束 {task.name}（{end - start:.1f}s）")
+        return task.name
+
+    def skip(name, reason):
+        with lock:
+            report[name] = {"status": "skipped", "result": None, "error": reason, "start": None, "end": None}
+        for child in dependents[name]:
+            if child not in report:
+                skip(child, f"依赖 {name} 未完成")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {executor.submit(execute, by_name[name]) for name, deps in remaining.items() if not deps}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = future.result()
+                if report[name]["status"] != "done":
+                    for child in dependents[name]:
+                        skip(child, f"依赖 {name} 失败")
+                    continue
+                for child in dependents[name]:
+                    remaining[child].discard(name)
+                    if not remaining[child] and child not in report:
+                        running.add(executor.submit(execute, by_name[child]))
+    return report
+
+
+def summarize(tasks, report):
+    """
+    汇总运行结果：总耗时、各节点耗时之和，以及按实际耗时计算的关键路径。
+    """
+    durations = {name: (r["end"] - r["start"]) if r["start"] is not None else 0.0 for name, r in report.items()}
+    longest = {}
+    previous = {}
+
+    def path_length(name):
+        if name not in longest:
+            task_deps = next(t.deps for t in tasks if t.name == name)
+            best_dep = max(task_deps, key=path_length, default=None)
+            previous[name] = best_dep
+            longest[name] = durations.get(name, 0.0) + (path_length(best_dep) if best_dep else 0.0)
+        return longest[name]
+
+    tail = max((t.name for t in tasks), key=path_length, default=None)
+    critical_path = []
+    while tail is not None:
+        critical_path.append(tail)
+        tail = previous[tail]
+    ends = [r["end"] for r in report.values() if r["end"] is not None]
+    return {
+        "wall_clock": max(ends) if ends else 0.0,
+        "sum_of_tasks": sum(durations.values()),
+        "critical_path": list(reversed(critical_path)),
+        "critical_path_length": longest.get(critical_path[0], 0.0) if critical_path else 0.0,
+        "status": {name: r["status"] for name, r in report.items()},
+    }
@@ -0,0 +1,113 @@
+import os
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class ThinkChainSplitter:
+    """
+    将流式返回的文本增量地拆分为思维链与正式回答。
+
+    与 remove_think_chain 的规则一致：<think> 与 </think> 之间的内容属于思维链，其余属于回答。
+    标签可能被拆分在两个分片之间，因此末尾可能构成标签前缀的字符会暂存到下一次 feed。
+    """
+
+    def __init__(self):
+        self.in_think = False
+        self.pending = ""
+
+    def feed(self, text):
+        """
+        输入一个文本分片，返回 [(kind, text), ...]，kind 为 "think" 或 "answer"。
+        """
+        segments = []
+        buf = self.pending + text
+        self.pending = ""
+        while buf:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            idx = buf.find(tag)
+            if idx != -1:
+                if idx:
+                    segments.append(("think" if self.in_think else "answer", buf[:idx]))
+                buf = buf[idx + len(tag):]
+                self.in_think = not self.in_think
+                continue
+            # 保留可能是标签开头的尾部字符
+            keep = 0
+            for n in range(min(len(tag) - 1, len(buf)), 0, -1):
+                if tag.startswith(buf[-n:]):
+                    keep = n
+                    break
+            emit = buf[:len(buf) - keep]
+            if emit:
+                segments.append(("think" if self.in_think else "answer", emit))
+            self.pending = buf[len(buf) - keep:]
+            break
+        return segments
+
+    def flush(self):
+        """流结束时输出暂存的字符。"""
+        segments = []
+        if self.pending:
+            segments.append(("think" if self.in_think else "answer", self.pending))
+            self.pending = ""
+        return segments
+
+
+class StreamFileWriter:
+    """
+    边接收边写文件：raw_path 保存带有思维链的完整输出，answer_path 只保存正式回答。
+
+    写入后立即 flush，下游可以读取部分结果；思维链只写入文件而不保留在内存中。
+    """
+
+    def __init__(self, raw_path=None, answer_path=None):
+        self.raw_file = _open_for_stream(raw_path)
+        self.answer_file = _open_for_stream(answer_path)
+        self.answer_parts = []
+        self.think_open = False
+
+    def write(self, kind, text):
+        if kind == "think":
+            if self.raw_file and not self.think_open:
+                self.raw_file.write(THINK_OPEN)
+                self.think_open = True
+            if self.raw_file:
+                self.raw_file.write(text)
+                self.raw_file.flush()
+            return
+        if self.think_open and self.raw_file:
+            self.raw_file.write(THINK_CLOSE)
+            self.think_open = False
+        if self.raw_file:
+            self.raw_file.write(text)
+            self.raw_file.flush()
+        if self.answer_file:
+            # 回答开头的空白与 remove_think_chain 的 strip 行为保持一致
+            if not self.answer_parts:
+                text = text.lstrip()
+                if not text:
+                    return
+            self.answer_file.write(text)
+            self.answer_file.flush()
+        self.answer_parts.append(text)
+
+    def close(self):
+        if self.think_open and self.raw_file:
+            self.raw_file.write(THINK_CLOSE)
+            self.think_open = False
+        for f in (self.raw_file, self.answer_file):
+            if f:
+                f.close()
+
+    @property
+    def answer(self):
+        return "".join(self.answer_parts).strip()
+
+
+def _open_for_stream(path):
+    if not path:
+        return None
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, "w", encoding="utf-8")
@@ -0,0 +1,214 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+DEFAULT_TELEMETRY_PATH = "data/telemetry/llm_calls.jsonl"
+
+# 每次进程运行的标识，写入每条记录，用于按运行汇总
+RUN_ID = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+
+# 当前调用的标签：stage（generation / judge / critic / improve）、chapter、section、retries 等
+_tags = contextvars.ContextVar("llm_telemetry_tags", default={})
+
+_settings = {"enabled": True, "path": DEFAULT_TELEMETRY_PATH, "prices": {}}
+_lock = threading.Lock()
+# record 每写一条记录都会调用的函数（如 artifact_store 写入数据库）
+_listeners = []
+
+
+def configure(telemetry_settings):
+    """
+    根据 config.json 中的 "telemetry" 配置记录位置与价格，例如：
+        {"enabled": true, "path": "data/telemetry/llm_calls.jsonl",
+         "prices": {"dsr1": {"input": 4, "output": 16}}}
+    prices 为每百万 token 的价格（输入/输出），只在汇总报告中用于估算费用。
+    """
+    global _settings
+    settings = {"enabled": True, "path": DEFAULT_TELEMETRY_PATH, "prices": {}}
+    settings.update(telemetry_settings or {})
+    _settings = settings
+
+
+@contextlib.contextmanager
+def tag(**fields):
+    """
+    在 with 块内为所有 LLM 调用附加标签，嵌套时内层覆盖外层的同名标签：
+        with telemetry.tag(stage="critic", section="方法/3.2"):
+            query_llm(...)
+    标签保存在 contextvars 中，asyncio 任务会自动继承；线程池中需用 contextvars.copy_context().run 传递。
+    """
+    token = _tags.set({**_tags.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def add_listener(fn):
+    """注册 fn(entry)，每条调用记录写入 JSONL 后调用。"""
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def current_tags():
+    return dict(_tags.get())
+
+
+def usage_fields(usage):
+    """
+    从接口返回的 usage 中提取 prompt/completion/reasoning/cached token 数，缺失的字段为 None。
+
+    命中服务商前缀缓存的 token 数来自 prompt_tokens_details.cached_tokens（OpenAI、豆包）
+    或 prompt_cache_hit_tokens（DeepSeek）。
+    """
+    if usage is None:
+        return {}
+
+    def get(obj, name):
+        if obj is None:
+            return None
+        return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+    return {
+        "prompt_tokens": get(usage, "prompt_tokens"),
+        "completion_tokens": get(usage, "completion_tokens"),
+        "reasoning_tokens": get(get(usage, "completion_tokens_details"), "reasoning_tokens"),
+        "cached_tokens": (get(get(usage, "prompt_tokens_details"), "cached_tokens")
+                          or get(usage, "prompt_cache_hit_tokens")),
+    }
+
+
+def record(model, latency, usage=None, ttft=None, cached=False, error=None, estimated=None, **extra):
+    """
+    追加一条调用记录到 JSONL 文件。
+
+    参数：
+        model (str): 模型别名。
+        latency (float): 调用耗时（秒）。
+        usage: 接口返回的 usage 对象或 dict；为 None 时可通过 estimated 传入估计的 token 数。
+        ttft (float): 流式调用的首 token 耗时。
+        cached (bool): 是否命中本地响应缓存。
+        error (str): 调用失败时的错误信息。
+        estimated (dict): 没有 usage 时的估计值 {"prompt_tokens", "completion_tokens"}。
+    """
+    if not _settings.get("enabled", True):
+        return
+    entry = {"ts": time.time(), "run_id": RUN_ID, "model": model,
+             "stage": None, "chapter": None, "section": None, "retries": 0}
+    entry.update(current_tags())
+    fields = usage_fields(usage)
+    if not fields.get("prompt_tokens") and estimated:
+        fields = dict(estimated)
+        entry["estimated"] = True
+    entry.update(fields)
+    entry.update({"latency": latency, "ttft": ttft, "cached": cached, "error": error})
+    entry.update(extra)
+    path = _settings.get("path", DEFAULT_TELEMETRY_PATH)
+    line = json.dumps(entry, ensure_ascii=False)
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError:
+        pass
+    for fn in _listeners:
+        fn(entry)
+
+
+def load_records(path=None, run_id=None):
+    """读取调用记录；run_id 为 "latest" 时只返回最近一次运行的记录。"""
+    path = path or _settings.get("path", DEFAULT_TELEMETRY_PATH)
+    records = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        return []
+    if run_id == "latest" and records:
+        run_id = records[-1].get("run_id")
+    if run_id:
+        records = [r for r in records if r.get("run_id") == run_id]
+    return records
+
+
+def _cost(entry, prices):
+    price = prices.get(entry.get("model"))
+    if not price:
+        return 0.0
+    return ((entry.get("prompt_tokens") or 0) * price.get("input", 0)
+            + (entry.get("completion_tokens") or 0) * price.get("output", 0)) / 1e6
+
+
+def aggregate(records, by=("model", "stage"), prices=None):
+    """
+    按 by 中的字段分组汇总：调用数、失败数、缓存命中数、重试数、各类 token 数、总耗时、平均/最大耗时、平均首 token 耗时与估算费用。
+
+    返回：
+        dict: "字段1=值1,字段2=值2" -> 汇总结果。
+    """
+    prices = _settings.get("prices", {}) if prices is None else prices
+    groups = defaultdict(list)
+    for r in records:
+        key = ",".join(f"{field}={r.get(field) if r.get(field) is not None else '-'}" for field in by)
+        groups[key].append(r)
+    report = {}
+    for key, items in sorted(groups.items()):
+        billed = [r for r in items if not r.get("cached")]
+        latencies = [r["latency"] for r in items if r.get("latency") is not None and not r.get("cached")]
+        ttfts = [r["ttft"] for r in items if r.get("ttft") is not None and not r.get("cached")]
+        report[key] = {
+            "calls": len(items),
+            "errors": sum(1 for r in items if r.get("error")),
+            "cached": sum(1 for r in items if r.get("cached")),
+            "retries": sum(1 for r in items if r.get("retries")),
+            "prompt_tokens": sum(r.get("prompt_tokens") or 0 for r in items if not r.get("cached")),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in items if not r.get("cached")),
+            "reasoning_tokens": sum(r.get("reasoning_tokens") or 0 for r in items if not r.get("cached")),
+            "cached_tokens": sum(r.get("cached_tokens") or 0 for r in billed),
+            # 服务商前缀缓存命中的 prompt token 比例
+            "prefix_cache_ratio": (sum(r.get("cached_tokens") or 0 for r in billed)
+                                   / max(1, sum(r.get("prompt_tokens") or 0 for r in billed))),
+            "latency_total": sum(latencies),
+            "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+            "latency_max": max(latencies) if latencies else None,
+            "ttft_mean": sum(ttfts) / len(ttfts) if ttfts else None,
+            "cost": sum(_cost(r, prices) for r in items if not r.get("cached")),
+        }
+    return report
+
+
+def run_report(run_id=RUN_ID, path=None):
+    """当前（或指定）运行的汇总：按模型与阶段、按章节、按小节。"""
+    records = load_records(path, run_id=run_id)
+    return {
+        "run_id": run_id,
+        "by_model_stage": aggregate(records, ("model", "stage")),
+        "by_chapter": aggregate(records, ("chapter",)),
+        "by_section": aggregate(records, ("chapter", "section", "stage")),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", type=str, default=DEFAULT_TELEMETRY_PATH)
+    parser.add_argument("--run", type=str, default="latest", help='运行 ID，"latest" 为最近一次运行，"all" 为全部记录')
+    parser.add_argument("--by", type=str, nargs="+", default=["model", "stage"],
+                        help="分组字段，如 model stage chapter section run_id")
+    args = parser.parse_args()
+    try:
+        import llm_registry
+        configure(llm_registry.get_settings().get("telemetry", {}))
+    except Exception:
+        pass
+    records = load_records(args.path, run_id=None if args.run == "all" else args.run)
+    print(json.dumps(aggregate(records, tuple(args.by)), ensure_ascii=False, indent=2))
@@ -0,0 +1,86 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_registry
+import util
+import critic_and_improve
+
+
+class FakeClient:
+    """按顺序返回预设回复的 chat.completions 客户端，记录实际发出的请求数。"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **params):
+        reply = self.replies[min(self.calls, len(self.replies) - 1)]
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=None)
+
+
+def _configure(monkeypatch, tmp_path, replies):
+    llm_registry.reset({"providers": {}, "cache": {"dir": str(tmp_path / "cache")},
+                        "telemetry": {"path": str(tmp_path / "calls.jsonl")},
+                        "artifact_store": {"enabled": False}})
+    monkeypatch.setattr(util, "_configured", False)
+    client = FakeClient(replies)
+    monkeypatch.setattr(util, "client_list", {"dsv3": client})
+    return client
+
+
+def test_parse_retry_sends_new_request(monkeypatch, tmp_path):
+    client = _configure(monkeypatch, tmp_path, ["not json", "still not json", '{"review": "ok"}'])
+    messages = [{"role": "user", "content": "critic"}]
+    _, parsed = critic_and_improve._query_and_parse(messages, "dsv3", expected_keys=("review",))
+    assert parsed == {"review": "ok"}
+    assert client.calls == 3
+
+
+def test_parse_retry_does_not_replay_cached_bad_reply(monkeypatch, tmp_path):
+    messages = [{"role": "user", "content": "critic"}]
+    client = _configure(monkeypatch, tmp_path, ["not json"])
+    try:
+        critic_and_improve._query_and_parse(messages, "dsv3", expected_keys=("review",))
+    except ValueError:
+        pass
+    assert client.calls == critic_and_improve.RETRY_COUNT
+
+    # 下一次运行：缓存中的坏回复最多命中一次，之后重新请求
+    client = _configure(monkeypatch, tmp_path, ['{"review": "ok"}'])
+    _, parsed = critic_and_improve._query_and_parse(messages, "dsv3", expected_keys=("review",))
+    assert parsed == {"review": "ok"}
+    assert client.calls == 1
+
+
+def test_repair_skips_think_chain(monkeypatch, tmp_path):
+    # 思维链中的公式有花括号，回答末尾多一个逗号：本地修复即可，不重新请求
+    reply = '<think>比较 $\\frac{a}{b}$ 与 [0, 1)</think>\n{"review": "ok", "severity": 2,}'
+    client = _configure(monkeypatch, tmp_path, [reply, '{"review": "requeried"}'])
+    messages = [{"role": "user", "content": "critic"}]
+    _, parsed = critic_and_improve._query_and_parse(messages, "dsv3", expected_keys=("review",))
+    assert parsed == {"review": "ok", "severity": 2}
+    assert client.calls == 1
+
+
+def test_failed_rounds_do_not_mark_draft_fresh(monkeypatch, tmp_path):
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.join(repo, "prompts"), tmp_path / "prompts")
+    for name in ("draft.txt", "essay.txt", "abs.txt", "example.txt", "draft_prompt.txt"):
+        (tmp_path / name).write_text(name, encoding="utf-8")
+    client = _configure(monkeypatch, tmp_path, ["not json"])
+    args = ("draft.txt", "essay.txt", "abs.txt", "draft_prompt.txt", "example.txt")
+
+    run_dir = critic_and_improve.iterate_critic_improve(*args, rounds=1, model="dsv3")
+    assert not os.path.exists(critic_and_improve._critic_pointer_path("draft.txt") + ".manifest.json")
+    assert not os.path.exists(os.path.join(run_dir, "final_draft.txt.manifest.json"))
+
+    # 下一次增量运行重新请求，而不是跳过这份草稿
+    calls = client.calls
+    critic_and_improve.iterate_critic_improve(*args, rounds=1, model="dsv3")
+    assert client.calls > calls
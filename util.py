@@ -1,125 +1,545 @@
-from volcenginesdkarkruntime import Ark
-from openai import OpenAI
-import json, os, re
-import chardet
-# 加载设置
-settings_path = os.path.join(os.path.dirname(__file__), "config.json")
-with open(settings_path, "r", encoding="utf-8") as f:
-    settings = json.load(f)
-
-# 从设置中获取 API 配置
-API_KEYS = settings["api_keys"]
-BASE_URLS = settings["base_urls"]
-
-# 豆包的服务
-client = Ark(
-    base_url=BASE_URLS["doubao"],
-    api_key=API_KEYS["doubao"]
-)
-
-# 移动的服务
-yidong_client = OpenAI(  
-    api_key=API_KEYS["yidong"],
-    base_url=BASE_URLS["yidong"]
-)
-
-openai_client = OpenAI(
-    api_key=API_KEYS["openai"],
-    base_url=BASE_URLS["openai"]
-)
-
-google_client = OpenAI(
-    api_key=API_KEYS["google"],
-    base_url=BASE_URLS["google"]
-)
-
-client_list = {"doubao":client,
-               "qwen3":yidong_client,
-               "dsv3":yidong_client,
-               "gpt-4.1":openai_client,
-               "dsr1":yidong_client,
-               "gemini-2.0-flash":google_client,
-               "gemini-2.5-pro":google_client
-               }
-
-model_name_list = {"doubao":"ep-20241031214346-9xd5h",
-               "qwen3":"qwen3-32b",
-               "dsv3":"deepseek-v3",
-               "gpt-4.1":"gpt-4.1",
-               "dsr1":"deepseek-r1",
-               "gemini-2.0-flash":"gemini-2.0-flash",
-               "gemini-2.5-pro":"gemini-2.5-pro"
-               }
-
-def query_llm(input_data, model='dsv3'):
+import asyncio
+import contextvars
+import json, os, re, time
+import threading
+import weakref
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limit import configure as configure_rate_limits, get_rate_limiter, estimate_tokens
+import llm_cache
+import llm_registry
+import http_transport
+import telemetry
+import cassette
+import artifact_store
+from retry import retry_after
+from llm_registry import has_think_chain, candidate_models
+from streaming import ThinkChainSplitter, StreamFileWriter
+
+class _RegistryView(Mapping):
+    """按模型别名惰性查询 llm_registry 的只读映射，保持 client_list 等旧接口可用。"""
+
+    def __init__(self, getter):
+        self._getter = getter
+
+    def __getitem__(self, alias):
+        return self._getter(alias)
+
+    def __iter__(self):
+        return iter(llm_registry.model_aliases())
+
+    def __len__(self):
+        return len(llm_registry.model_aliases())
+
+# 模型别名 -> 客户端 / 服务商模型名 / 服务商，均在首次访问时才读取 config.json 并创建客户端
+client_list = _RegistryView(llm_registry.get_client)
+model_name_list = _RegistryView(llm_registry.model_name)
+provider_list = _RegistryView(llm_registry.provider_of)
+
+# 各服务商的异步并发上限，可在 config.json 的 "concurrency" 中覆盖
+DEFAULT_CONCURRENCY = 8
+
+_configured = False
+_configure_lock = threading.Lock()
+
+def _ensure_configured():
+    """首次调用 LLM 时根据 config.json 配置限速器与响应缓存。"""
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if not _configured:
+            settings = llm_registry.get_settings()
+            # 各服务商的 rpm/tpm 限速，见 config.json 的 "rate_limits"
+            configure_rate_limits(settings.get("rate_limits", {}))
+            # 磁盘响应缓存，见 config.json 的 "cache"
+            llm_cache.configure(settings.get("cache", {}))
+            # 调用记录（token、耗时、重试），见 config.json 的 "telemetry"
+            telemetry.configure(settings.get("telemetry", {}))
+            # 请求录制/回放，见 config.json 的 "cassette" 与环境变量 ESSAY4THESIS_CASSETTE
+            cassette.configure(settings.get("cassette", {}))
+            # 运行记录数据库（请求、候选、评审、批评-修订），见 config.json 的 "artifact_store"
+            artifact_store.configure(settings.get("artifact_store", {}))
+            _configured = True
+
+RATE_LIMIT_PAUSE = 10
+
+def _rate_limit_pause(e):
+    """若异常为 429，返回应暂停的秒数（优先使用 Retry-After），否则返回 None。"""
+    if getattr(e, "status_code", None) != 429:
+        return None
+    hinted = retry_after(e)
+    return hinted if hinted is not None else RATE_LIMIT_PAUSE
+
+def _settle_rate_limit(limiter, reserved_tokens, completion):
+    """根据返回的 usage 修正预留的 token 数。"""
+    usage = getattr(completion, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        limiter.adjust(usage.total_tokens - reserved_tokens)
+
+CACHE_MODES = ("use", "refresh", "bypass")
+
+def _cache_lookup(model, messages, params, cache, cache_salt):
+    """
+    按缓存模式查询缓存，返回 (缓存键, 命中的内容)。
+
+    cache 为 "use" 时先读后写，"refresh" 时忽略旧记录并覆盖，"bypass" 时不读不写（缓存键为 None）。
+    """
+    if cache not in CACHE_MODES:
+        raise ValueError(f"cache 必须是 {CACHE_MODES} 之一")
+    _ensure_configured()
+    response_cache = llm_cache.get_cache()
+    if response_cache is None or cache == "bypass":
+        return None, None
+    key_params = dict(params or {})
+    if cache_salt is not None:
+        key_params["__cache_salt__"] = cache_salt
+    key = llm_cache.make_key(model_name_list[model], messages, key_params)
+    if cache == "refresh":
+        return key, None
+    return key, response_cache.get(key)
+
+def _cache_store(key, model, content):
+    response_cache = llm_cache.get_cache()
+    if key is not None and response_cache is not None and content:
+        response_cache.set(key, content, {"model": model})
+
+def _cassette_lookup(model, messages, params, cache_salt):
+    """
+    录制/回放模式下返回 (录制键, 回放内容)：回放模式直接返回录制的响应（找不到时抛出 cassette.CassetteMiss），
+    录制模式只返回键；未启用时返回 (None, None)。
+    """
+    _ensure_configured()
+    tape = cassette.get_cassette()
+    if tape.mode == "off":
+        return None, None
+    key = tape.key(model_name_list[model], messages, params, cache_salt)
+    if tape.mode == "replay":
+        return key, tape.replay(key, model)
+    return key, None
+
+def _cassette_record(key, model, messages, content):
+    tape = cassette.get_cassette()
+    if key is not None and tape.mode == "record" and content:
+        tape.record(key, model, messages, content)
+
+def pool_stats():
+    """返回共享 HTTP 连接池的统计信息，见 http_transport.pool_stats。"""
+    return http_transport.pool_stats()
+
+def cache_stats():
+    """返回响应缓存的命中/未命中统计，缓存未启用时返回 None。"""
+    _ensure_configured()
+    response_cache = llm_cache.get_cache()
+    return response_cache.stats() if response_cache is not None else None
+
+def _build_messages(input_data):
+    """将 str 输入包装为消息列表，list 输入原样返回。"""
+    if isinstance(input_data, list):
+        return input_data
+    elif isinstance(input_data, str):
+        return [
+            {
+                "role": "system",
+                "content": "You are a helpful assistant."
+            },
+            {
+                "role": "user",
+                "content": input_data
+            }
+        ]
+    else:
+        raise ValueError("输入类型必须是 list 或 str")
+
+def query_llm(input_data, model='dsv3', remove_think=False, params=None, cache="use", cache_salt=None, raise_on_error=False):
     """
     根据输入类型（list 或 str）调用相应的 LLM 接口并返回结果。
     
     参数:
         input_data (list or str): 输入数据，可以是消息列表或单个提示字符串。
+        model (str): 模型别名，见 client_list。
+        remove_think (bool): 为 True 且模型带有思维链（见 llm_registry.has_think_chain）时，移除返回中的思维链。
+        params (dict): 额外的采样参数（如 temperature），原样传给接口并参与缓存键计算。
+        cache (str): 缓存模式，"use" 读写缓存，"refresh" 强制重新请求并覆盖，"bypass" 不使用缓存。
+        cache_salt (str): 区分相同请求的多次独立采样（如多次投票），参与缓存键计算。
+        raise_on_error (bool): 为 True 时调用失败直接抛出原异常（供调用方按 retry.classify_error 分类重试），
+            否则打印错误并返回 ""（list 输入）或 None（str 输入）。
     
     返回:
         str: LLM 的响应结果。
     """
-    if isinstance(input_data, list):
-        # 如果输入是列表，使用 query_doubao_w_messages
-        try:
+    messages = _build_messages(input_data)
+    start = time.monotonic()
+    tape_key, content = _cassette_lookup(model, messages, params, cache_salt)
+    if content is not None:
+        telemetry.record(model, time.monotonic() - start, cached=True, replayed=True)
+        return remove_think_chain(content) if remove_think and has_think_chain(model) else content
+    cache_key, content = _cache_lookup(model, messages, params, cache, cache_salt)
+    if content is not None:
+        telemetry.record(model, time.monotonic() - start, cached=True)
+        _cassette_record(tape_key, model, messages, content)
+        if remove_think and has_think_chain(model):
+            content = remove_think_chain(content)
+        return content
 
-            # 标准请求
-            #print("----- standard request -----")
-            completion = client_list[model].chat.completions.create(
-                model=model_name_list[model],
-                messages=input_data
-            )
-            return completion.choices[0].message.content
+    limiter = get_rate_limiter(provider_list[model])
+    reserved_tokens = estimate_tokens(messages)
+    try:
+        limiter.acquire(reserved_tokens)
+        # 标准请求
+        #print("----- standard request -----")
+        completion = client_list[model].chat.completions.create(
+            model=model_name_list[model],
+            messages=messages,
+            **(params or {})
+        )
+        _settle_rate_limit(limiter, reserved_tokens, completion)
+        content = completion.choices[0].message.content
+        telemetry.record(model, time.monotonic() - start, usage=getattr(completion, "usage", None),
+                         estimated={"prompt_tokens": reserved_tokens, "completion_tokens": estimate_tokens(content)})
+        _cache_store(cache_key, model, content)
+        _cassette_record(tape_key, model, messages, content)
+        if remove_think and has_think_chain(model):
+            content = remove_think_chain(content)
+        return content
 
-        except Exception as e:
-            print(f"调用API时发生错误: {str(e)}")
-            return ""
-    elif isinstance(input_data, str):
-        # 如果输入是字符串，使用 query_doubao
-        try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant."
-                },
-                {
-                    "role": "user",
-                    "content": input_data
-                }
-            ]
-
-            # 标准请求
-            #print("----- standard request -----")
-            completion = client_list[model].chat.completions.create(
+    except Exception as e:
+        pause = _rate_limit_pause(e)
+        if pause is not None:
+            limiter.pause(pause)
+        telemetry.record(model, time.monotonic() - start, error=repr(e))
+        if raise_on_error:
+            raise
+        print(model+"-----调用错误")
+        print(f"调用API时发生错误: {str(e)}")
+        return "" if isinstance(input_data, list) else None
+
+def query_llm_stream(input_data, model='dsv3', raw_path=None, output_path=None, params=None, cache="use", cache_salt=None, on_delta=None):
+    """
+    以流式方式调用 LLM，边接收边写文件，并实时拆分思维链与正式回答。
+
+    思维链既可能以 <think>...</think> 出现在 content 中，也可能通过 reasoning_content 字段返回，
+    两种情况都会写入 raw_path（带思维链的完整输出），只有正式回答写入 output_path。
+
+    参数:
+        input_data (list or str): 输入数据，可以是消息列表或单个提示字符串。
+        model (str): 模型别名，见 client_list。
+        raw_path (str): 带有思维链的输出文件路径，为 None 时不保存。
+        output_path (str): 正式回答的输出文件路径，为 None 时不保存。
+        params, cache, cache_salt: 与 query_llm 相同。
+        on_delta (callable): 每收到一段文本时回调 on_delta(kind, text)，kind 为 "think" 或 "answer"。
+
+    返回:
+        tuple: (正式回答, 统计信息 dict)，统计信息包含 ttft（首 token 耗时，秒）、
+               ttfa（首个回答 token 耗时）、elapsed（总耗时）与 cached（是否命中缓存）。
+    """
+    messages = _build_messages(input_data)
+    stats = {"ttft": None, "ttfa": None, "elapsed": None, "cached": False}
+    start = time.monotonic()
+    writer = StreamFileWriter(raw_path, output_path)
+    splitter = ThinkChainSplitter()
+
+    def emit(kind, text):
+        if stats["ttft"] is None:
+            stats["ttft"] = time.monotonic() - start
+        if kind == "answer" and stats["ttfa"] is None and text.strip():
+            stats["ttfa"] = time.monotonic() - start
+        writer.write(kind, text)
+        if on_delta:
+            on_delta(kind, text)
+
+    tape_key, cached = _cassette_lookup(model, messages, params, cache_salt)
+    replayed = cached is not None
+    if not replayed:
+        cache_key, cached = _cache_lookup(model, messages, params, cache, cache_salt)
+    if cached is not None:
+        stats["cached"] = True
+        for kind, text in splitter.feed(cached) + splitter.flush():
+            emit(kind, text)
+        writer.close()
+        stats["elapsed"] = time.monotonic() - start
+        telemetry.record(model, stats["elapsed"], cached=True, replayed=replayed)
+        if not replayed:
+            _cassette_record(tape_key, model, messages, cached)
+        return writer.answer, stats
+
+    limiter = get_rate_limiter(provider_list[model])
+    reserved_tokens = estimate_tokens(messages)
+    # 写入缓存或录制需要完整的原始输出；若已写入 raw_path，结束后从文件读回，避免在内存中保留思维链
+    keep_raw = cache_key is not None or tape_key is not None
+    raw_parts = [] if keep_raw and not raw_path else None
+    usage = None
+    try:
+        limiter.acquire(reserved_tokens)
+        response = client_list[model].chat.completions.create(
+            model=model_name_list[model],
+            messages=messages,
+            stream=True,
+            **(params or {})
+        )
+        for chunk in response:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+                _settle_rate_limit(limiter, reserved_tokens, chunk)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            reasoning = getattr(delta, "reasoning_content", None)
+            if reasoning:
+                emit("think", reasoning)
+                if raw_parts is not None:
+                    raw_parts.append(("think", reasoning))
+            if delta.content:
+                for kind, text in splitter.feed(delta.content):
+                    emit(kind, text)
+                    if raw_parts is not None:
+                        raw_parts.append((kind, text))
+        for kind, text in splitter.flush():
+            emit(kind, text)
+            if raw_parts is not None:
+                raw_parts.append((kind, text))
+    except Exception as e:
+        pause = _rate_limit_pause(e)
+        if pause is not None:
+            limiter.pause(pause)
+        print(model+"-----调用错误")
+        print(f"调用API时发生错误: {str(e)}")
+        writer.close()
+        stats["elapsed"] = time.monotonic() - start
+        telemetry.record(model, stats["elapsed"], ttft=stats["ttft"], error=repr(e))
+        return "", stats
+
+    writer.close()
+    stats["elapsed"] = time.monotonic() - start
+    # 未请求 stream_options={"include_usage": True} 时接口不返回 usage，按输出文本估计 token 数
+    telemetry.record(model, stats["elapsed"], usage=usage, ttft=stats["ttft"],
+                     estimated={"prompt_tokens": reserved_tokens, "completion_tokens": estimate_tokens(writer.answer)})
+    if keep_raw and writer.answer:
+        if raw_parts is None:
+            with open(raw_path, "r", encoding="utf-8") as f:
+                raw = f.read()
+        else:
+            raw, in_think = "", False
+            for kind, text in raw_parts:
+                if (kind == "think") != in_think:
+                    raw += "<think>" if kind == "think" else "</think>"
+                    in_think = kind == "think"
+                raw += text
+            if in_think:
+                raw += "</think>"
+        _cache_store(cache_key, model, raw)
+        _cassette_record(tape_key, model, messages, raw)
+    return writer.answer, stats
+
+# 异步客户端与信号量都绑定在事件循环上，按事件循环和服务商惰性创建
+_async_clients = weakref.WeakKeyDictionary()
+_async_semaphores = weakref.WeakKeyDictionary()
+
+def _get_async_client(model):
+    provider = provider_list[model]
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if provider not in clients:
+        clients[provider] = llm_registry.new_client(provider, asynchronous=True)
+    return clients[provider]
+
+def _get_async_semaphore(model):
+    provider = provider_list[model]
+    semaphores = _async_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if provider not in semaphores:
+        semaphores[provider] = asyncio.Semaphore(llm_registry.get_settings().get("concurrency", {}).get(provider, DEFAULT_CONCURRENCY))
+    return semaphores[provider]
+
+async def aquery_llm(input_data, model='dsv3', remove_think=False, params=None, cache="use", cache_salt=None, raise_on_error=False):
+    """
+    query_llm 的异步版本，可在同一事件循环中并发发起大量请求。
+
+    每个服务商的同时在途请求数受 config.json 中 "concurrency" 的限制（默认 8）。
+
+    参数:
+        input_data (list or str): 输入数据，可以是消息列表或单个提示字符串。
+        model (str): 模型别名，见 client_list。
+        remove_think (bool): 为 True 且模型带有思维链（见 llm_registry.has_think_chain）时，移除返回中的思维链。
+        params, cache, cache_salt, raise_on_error: 与 query_llm 相同。
+
+    返回:
+        str: LLM 的响应结果；调用失败时与 query_llm 一致（list 输入返回 ""，str 输入返回 None）。
+    """
+    messages = _build_messages(input_data)
+    start = time.monotonic()
+    tape_key, content = _cassette_lookup(model, messages, params, cache_salt)
+    if content is not None:
+        telemetry.record(model, time.monotonic() - start, cached=True, replayed=True)
+        return remove_think_chain(content) if remove_think and has_think_chain(model) else content
+    cache_key, content = _cache_lookup(model, messages, params, cache, cache_salt)
+    if content is not None:
+        telemetry.record(model, time.monotonic() - start, cached=True)
+        _cassette_record(tape_key, model, messages, content)
+        if remove_think and has_think_chain(model):
+            content = remove_think_chain(content)
+        return content
+
+    limiter = get_rate_limiter(provider_list[model])
+    reserved_tokens = estimate_tokens(messages)
+    sent = False
+    try:
+        async with _get_async_semaphore(model):
+            await limiter.aacquire(reserved_tokens)
+            sent = True
+            completion = await _get_async_client(model).chat.completions.create(
                 model=model_name_list[model],
                 messages=messages,
+                **(params or {})
             )
-            return completion.choices[0].message.content
+        _settle_rate_limit(limiter, reserved_tokens, completion)
+        content = completion.choices[0].message.content
+        telemetry.record(model, time.monotonic() - start, usage=getattr(completion, "usage", None),
+                         estimated={"prompt_tokens": reserved_tokens, "completion_tokens": estimate_tokens(content)})
+        _cache_store(cache_key, model, content)
+        _cassette_record(tape_key, model, messages, content)
+        if remove_think and has_think_chain(model):
+            content = remove_think_chain(content)
+        return content
+    except asyncio.CancelledError:
+        # 已发出的请求被取消（如投票提前结束）时服务商仍可能计费，同样记录；还在排队的请求不记录
+        if sent:
+            telemetry.record(model, time.monotonic() - start, error="cancelled", cancelled=True,
+                             estimated={"prompt_tokens": reserved_tokens, "completion_tokens": 0})
+        raise
+    except Exception as e:
+        pause = _rate_limit_pause(e)
+        if pause is not None:
+            limiter.pause(pause)
+        telemetry.record(model, time.monotonic() - start, error=repr(e))
+        if raise_on_error:
+            raise
+        print(model+"-----调用错误")
+        print(f"调用API时发生错误: {str(e)}")
+        return "" if isinstance(input_data, list) else None
+
+# 同步代码中执行协程时共用的后台事件循环，使异步客户端、连接池与并发信号量在多次调用之间复用
+_background_loop = None
+_background_loop_lock = threading.Lock()
 
-        except Exception as e:
-            print(model+"-----调用错误")
-            print(f"调用API时发生错误: {str(e)}")
+def run_async(coro):
+    """
+    在共享的后台事件循环中执行协程并阻塞等待结果，可在多个线程中同时调用。
+
+    与每次 asyncio.run 新建事件循环不同，按事件循环缓存的异步客户端只创建一次，
+    HTTP 连接可以保持复用。调用方的 contextvars（如 telemetry 标签）会传入协程。
+    """
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-llm", daemon=True).start()
+            _background_loop = loop
+    context = contextvars.copy_context()
+
+    async def run_in_context():
+        for var, value in context.items():
+            var.set(value)
+        return await coro
+
+    return asyncio.run_coroutine_threadsafe(run_in_context(), _background_loop).result()
+
+def _generate_tagged(generate_fn, model_name):
+    with telemetry.tag(stage="generation"):
+        return generate_fn(model_name)
+
+def generate_candidates(generate_fn, model_names, concurrent=True, max_workers=None):
+    """
+    使用多个模型生成候选内容。
+
+    参数：
+        generate_fn (callable): 接收模型名、返回该模型生成内容的函数（负责保存候选文件）。
+        model_names (list): 模型名称列表。
+        concurrent (bool): 是否同时向所有模型发送请求；为 False 时按顺序逐个调用。
+        max_workers (int): 并发模式下的最大线程数，默认与模型数量相同。
+
+    返回：
+        list: 按 model_names 顺序排列的 (模型名, 候选内容) 列表，生成失败的模型会被跳过。
+    """
+    results = {}
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=max_workers or len(model_names) or 1) as executor:
+            # 每个线程在调用方上下文的副本中执行，使 telemetry 标签（章节、小节）传递到线程内
+            futures = {executor.submit(context.run, _generate_tagged, generate_fn, model_name): model_name
+                       for model_name in model_names for context in [contextvars.copy_context()]}
+            # 每个候选在完成时即由 generate_fn 写入文件，这里只负责收集结果
+            for future in as_completed(futures):
+                model_name = futures[future]
+                try:
+                    results[model_name] = future.result()
+                except cassette.CassetteMiss:
+                    raise
+                except Exception as e:
+                    print(f"{model_name} 生成候选时发生错误: {str(e)}")
     else:
-        raise ValueError("输入类型必须是 list 或 str")
+        for model_name in model_names:
+            try:
+                results[model_name] = _generate_tagged(generate_fn, model_name)
+            except cassette.CassetteMiss:
+                raise
+            except Exception as e:
+                print(f"{model_name} 生成候选时发生错误: {str(e)}")
+
+    for model_name in model_names:
+        if results.get(model_name):
+            artifact_store.record_candidate(model_name, results[model_name])
+
+    # 按固定顺序返回，保证 best_of_N_candidates 的编号稳定
+    return [(model_name, results[model_name]) for model_name in model_names if results.get(model_name)]
+
+# load_prompt 的缓存：路径 -> (mtime_ns, 文件大小, 内容)，以及路径 -> 上次使用的编码
+_prompt_cache = {}
+_prompt_encodings = {}
+_prompt_lock = threading.Lock()
+
+def _decode_prompt(path, raw_data):
+    """依次尝试 UTF-8、上次使用的编码，最后才用 chardet 检测编码。"""
+    tried = []
+    # utf-8-sig 同时兼容无 BOM 的 UTF-8；UTF-8 必须先于记住的编码尝试，否则文件改存为 UTF-8 后
+    # 仍会被 GBK 等编码“成功”解码为乱码
+    for encoding in ("utf-8-sig", _prompt_encodings.get(path)):
+        if encoding and encoding not in tried:
+            tried.append(encoding)
+            try:
+                return raw_data.decode(encoding), encoding
+            except (UnicodeDecodeError, LookupError):
+                pass
+    import chardet
+    detected_encoding = chardet.detect(raw_data)['encoding'] or "utf-8"
+    return raw_data.decode(detected_encoding, errors="replace"), detected_encoding
 
 def load_prompt(file_path='./prompts/sys_prompt1.txt'):
     """
     加载提示词文件内容。
 
+    按 (路径, mtime, 文件大小) 缓存，文件未修改时直接返回内存中的内容；
+    解码时优先使用 UTF-8，失败后才用 chardet 检测，检测到的编码会被记住。
+
     参数：
         file_path (str): 提示词文件路径。
 
     返回：
         str: 提示词内容。
     """
-    with open(file_path, 'rb') as f:
-        raw_data = f.read()
-        detected_encoding = chardet.detect(raw_data)['encoding']
+    path = os.path.abspath(file_path)
+    st = os.stat(path)
+    with _prompt_lock:
+        cached = _prompt_cache.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
 
-    with open(file_path, 'r', encoding=detected_encoding) as f:
-        return f.read()
+    with open(path, 'rb') as f:
+        raw_data = f.read()
+    content, encoding = _decode_prompt(path, raw_data)
+    # 与文本模式读取一致，统一换行符
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    with _prompt_lock:
+        _prompt_encodings[path] = encoding
+        _prompt_cache[path] = (st.st_mtime_ns, st.st_size, content)
+    return content
 
 def save_to_file(content, file_path="data/thesis/draft.tex"):
     """
@@ -148,13 +568,67 @@ def remove_think_chain(response):
     return cleaned_response.strip()
 
 
-def parse_llm_json(text, save_failed_path=None):
+def _json_spans(s):
+    """
+    单遍扫描 s，返回所有顶层 {...} / [...] 片段，每个片段为 (起点, 终点, 内部片段列表)。
+
+    所有未闭合的 { [ 的位置都记在栈中，遇到同类的 } ] 时出栈得到一个片段；扫描结束时仍未闭合的括号
+    （如正文中孤立的 "{"、半开区间 "[0, 1)"，或被截断的输出）不作为候选，其内部已闭合的片段提升为上一层的片段，
+    不会重新扫描。只在括号内部跟踪字符串与转义，因此字符串中的 } ] 不会提前结束匹配；
+    合法 JSON 的字符串中不能有换行，遇到换行时结束字符串，正文中落单的引号只影响所在的一行。
+    """
+    top = []
+    # 每层为 [起点, 闭合括号, 内部片段列表]
+    stack = []
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(s):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"' or ch == '\n':
+                in_string = False
+        elif ch == '{' or ch == '[':
+            stack.append([i, '}' if ch == '{' else ']', []])
+        elif not stack:
+            continue
+        elif ch == '"':
+            in_string = True
+        elif ch == stack[-1][1]:
+            start, _, children = stack.pop()
+            (stack[-1][2] if stack else top).append((start, i + 1, children))
+    while stack:
+        _, _, children = stack.pop()
+        (stack[-1][2] if stack else top).extend(children)
+    return top
+
+
+def _fenced_ranges(s):
+    """``` 代码块的 (起点, 终点) 列表。"""
+    ranges = []
+    pos = s.find('```')
+    while pos != -1:
+        close = s.find('```', pos + 3)
+        if close == -1:
+            break
+        ranges.append((pos, close))
+        pos = s.find('```', close + 3)
+    return ranges
+
+
+def parse_llm_json(text, save_failed_path=None, expected_keys=None):
     """从 LLM 的返回文本中提取并解析 JSON 内容。
 
     支持如下常见情形：
     - 纯 JSON 文本
     - 包含代码块 ```json ... ``` 的情形
-    - 响应中包含前后说明文字，函数会在第一个 JSON 对象/数组的起止处尝试提取
+    - 响应中包含前后说明文字或 <think> 思维链，函数会逐个尝试文本中的所有顶层 JSON 对象/数组
+
+    选择顺序：优先使用 </think> 之后的内容；其中包含全部 expected_keys 的对象优先，其次是代码块内的值，
+    再次是对象优先于数组，最后按出现顺序取第一个可以解析的值。扫描会跳过字符串中的括号，
+    正文中未闭合或无法解析的括号不会挡住其后的 JSON。
 
     返回解析后的 Python 对象（dict 或 list）。若无法解析则抛出 ValueError。
     """
@@ -162,54 +636,123 @@ def parse_llm_json(text, save_failed_path=None):
         raise ValueError('输入必须是字符串')
 
     s = text.strip()
+    expected = set(expected_keys or ())
+    decoder = json.JSONDecoder()
 
-    # 优先查找 ```json 或 ``` 包裹的代码块
-    m = re.search(r"```(?:json)?\s*(\{[\s\S]*\}|\[[\s\S]*\])\s*```", s, flags=re.IGNORECASE)
-    if m:
-        candidate = m.group(1).strip()
-        try:
-            return json.loads(candidate)
-        except Exception as e:
-            # 保存原始响应以便离线检查
-            if save_failed_path:
-                os.makedirs(os.path.dirname(save_failed_path), exist_ok=True)
-                with open(save_failed_path, 'w', encoding='utf-8') as f:
-                    f.write(s)
-            raise ValueError(f'解析代码块内 JSON 失败: {e}') from e
-
-    # 否则，尝试找到第一个 JSON 对象或数组并做配对查找
-    s_len = len(s)
-    for start_char in ['{', '[']:
-        start_idx = s.find(start_char)
-        if start_idx == -1:
-            continue
-        stack = []
-        for i in range(start_idx, s_len):
-            ch = s[i]
-            if ch == '{' or ch == '[':
-                stack.append(ch)
-            elif ch == '}' or ch == ']':
-                if not stack:
-                    break
-                opening = stack.pop()
-                # 简单配对，不严格检查类型一致性
-                if not stack:
-                    candidate = s[start_idx:i+1]
-                    try:
-                        return json.loads(candidate)
-                    except Exception as e:
-                        if save_failed_path:
-                            os.makedirs(os.path.dirname(save_failed_path), exist_ok=True)
-                            with open(save_failed_path, 'w', encoding='utf-8') as f:
-                                f.write(s)
-                        raise ValueError(f'解析提取到的 JSON 失败: {e}') from e
-
-    # 最后尝试直接 json.loads（如果字符串就是 JSON）
-    try:
-        return json.loads(s)
-    except Exception as e:
-        if save_failed_path:
-            os.makedirs(os.path.dirname(save_failed_path), exist_ok=True)
-            with open(save_failed_path, 'w', encoding='utf-8') as f:
-                f.write(s)
-        raise ValueError(f'无法从模型响应中解析 JSON: {e}') from e
\ No newline at end of file
+    # 先看思维链之后的正式回答，找不到时再搜索全文
+    think_end = s.rfind('</think>')
+    regions = [s[think_end + len('</think>'):], s] if think_end != -1 else [s]
+
+    last_error = None
+    for region in regions:
+        fences = _fenced_ranges(region)
+        best = None
+        spans = _json_spans(region)
+        k = 0
+        while k < len(spans):
+            start, end, children = spans[k]
+            k += 1
+            try:
+                value, _ = decoder.raw_decode(region[start:end])
+            except ValueError as e:
+                last_error = e
+                # 片段本身不是合法 JSON（如 "{见下文 {...} }"）时，继续尝试扫描时已记录的内部片段
+                spans[k:k] = children
+                continue
+            # 包含全部 expected_keys 的对象优先，其次是代码块内的值，再次是对象优先于数组（如正文中的 "[1]"）
+            rank = (bool(expected) and isinstance(value, dict) and expected <= value.keys(),
+                    any(a < start and end <= b for a, b in fences),
+                    isinstance(value, dict))
+            if best is None or rank > best[0]:
+                best = (rank, value)
+            if rank[0]:
+                break
+        if best is not None:
+            return best[1]
+
+    if save_failed_path:
+        os.makedirs(os.path.dirname(save_failed_path), exist_ok=True)
+        with open(save_failed_path, 'w', encoding='utf-8') as f:
+            f.write(s)
+    raise ValueError(f'无法从模型响应中解析 JSON: {last_error or "未找到 JSON 对象或数组"}')
+
+def repair_json(text):
+    """
+    对模型输出的 JSON 做本地修复，返回修复后的文本（不保证一定能解析）：
+    - 与 parse_llm_json 一样只处理最后一个 </think> 之后的正式回答（其中没有 JSON 时才使用全文），
+      思维链中的公式与括号不会被当作 JSON 的开头；
+    - 去掉 ```json 代码块标记和第一个 { 或 [ 之前的说明文字；
+    - 字符串内未转义的双引号（后面不是 , : } ] 的引号）、换行与制表符会被转义；
+    - 删除 } 或 ] 前多余的逗号；
+    - 输出被截断时补全未闭合的字符串和括号。
+    """
+    text = text or ""
+    think_end = text.rfind('</think>')
+    if think_end != -1:
+        answer = text[think_end + len('</think>'):]
+        if '{' in answer or '[' in answer:
+            text = answer
+    s = re.sub(r"```(?:json)?", "", text, flags=re.IGNORECASE)
+    starts = [i for i in (s.find('{'), s.find('[')) if i != -1]
+    if not starts:
+        return s.strip()
+    s = s[min(starts):]
+
+    out = []
+    stack = []
+    in_string = False
+    i = 0
+    n = len(s)
+    while i < n:
+        ch = s[i]
+        if in_string:
+            if ch == '\\' and i + 1 < n:
+                out.append(s[i:i + 2])
+                i += 2
+                continue
+            if ch == '"':
+                j = i + 1
+                while j < n and s[j] in ' \t\r\n':
+                    j += 1
+                if j >= n or s[j] in ',:}]':
+                    in_string = False
+                    out.append(ch)
+                else:
+                    out.append('\\"')
+            elif ch == '\n':
+                out.append('\\n')
+            elif ch == '\r':
+                out.append('\\r')
+            elif ch == '\t':
+                out.append('\\t')
+            else:
+                out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            # 删除结尾多余的逗号
+            while out and out[-1].strip() == '':
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+        else:
+            out.append(ch)
+        i += 1
+
+    if in_string:
+        out.append('"')
+    while out and out[-1].strip() == '':
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+    out.extend(reversed(stack))
+    return ''.join(out)